@@ -0,0 +1,133 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tool'))
+
+from models import (img23d_TripoSR, lmm_gpt4v, lmm_llava_7b, lmm_llava_34b, log, text2img_sdxl,
+                    text2img_sdxl_replicate)
+from lmm_cache import lmm_cached
+from pipeline import Locked, run_case
+
+
+def load_models(args):
+    # init LMM,T2I,I23D once for every case
+    log('loading lmm...')
+    if args.lmm == 'gpt4v':
+        lmm = lmm_gpt4v(args.openai_key, max_concurrency=args.remote_concurrency)
+    elif args.lmm == 'llava-34b':
+        lmm = lmm_llava_34b(model_path=args.lmm_path or "llava-hf/llava-v1.6-34b-hf", gpuid=args.lmm_gpu)
+    else:
+        lmm = lmm_llava_7b(model_path=args.lmm_path or "llava-hf/llava-v1.6-mistral-7b-hf", gpuid=args.lmm_gpu)
+
+    log('loading t2i...')
+    if args.t2i == 'sdxl-replicate':
+        t2i = text2img_sdxl_replicate(args.replicate_key, max_concurrency=args.remote_concurrency)
+    else:
+        t2i = text2img_sdxl(sdxl_base_path=args.sdxl_base_path, sdxl_refiner_path=args.sdxl_refiner_path,
+                            gpuid=args.t2i_gpu)
+
+    log('loading i23d...')
+    i23d = img23d_TripoSR(model_path=args.i23d_path, gpuid=args.i23d_gpu)
+    log('loading finish.')
+    lmm_backend = type(lmm).__name__
+    lmm = Locked(lmm)
+    if args.lmm_cache:
+        # cache hits are answered without taking the LMM lock
+        lmm = lmm_cached(lmm, db_path=args.lmm_cache, max_bytes=args.lmm_cache_mb * 1024**2, backend=lmm_backend,
+                         model_id=lmm.model_path, cache_sampled=args.cache_sampled)
+    return lmm, Locked(t2i), Locked(i23d)
+
+
+def main(args):
+    case_dirs = sorted(d for d in glob.glob(os.path.join(args.dataset, args.cases)) if os.path.isdir(d))
+    if len(case_dirs) == 0:
+        log(f'Error: no cases matching {args.cases} in {args.dataset}')
+        return
+    lmm, t2i, i23d = load_models(args)
+
+    def process(case_dir):
+        name = os.path.basename(case_dir.rstrip('/'))
+        start_time = time.time()
+        mesh_path = run_case(lmm, t2i, i23d, case_dir, os.path.join(args.output, name),
+                             num_img=args.num_img, num_draft=args.num_draft, max_iters=args.max_iters, name=name,
+                             t2i_batch_size=args.t2i_batch_size, resume=not args.no_resume)
+        return {'case': name, 'mesh': mesh_path, 'seconds': time.time() - start_time}
+
+    # cases run concurrently so that one waiting on the LMM doesn't idle the T2I and I23D devices
+    start_time = time.time()
+    results, failures = [], []
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        futures = {executor.submit(process, case_dir): case_dir for case_dir in case_dirs}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception:
+                failures.append({'case': os.path.basename(futures[future]), 'error': traceback.format_exc()})
+                log(f'{os.path.basename(futures[future])} failed:\n{failures[-1]["error"]}')
+                continue
+            results.append(result)
+            elapsed = time.time() - start_time
+            log(f'{result["case"]} done in {result["seconds"]:.1f}s '
+                f'({len(results)}/{len(case_dirs)} cases, {len(results) / elapsed * 3600:.1f} cases/hour)')
+
+    elapsed = time.time() - start_time
+    summary = {
+        'cases': len(case_dirs),
+        'finished': len(results),
+        'failed': len(failures),
+        'seconds': elapsed,
+        'cases_per_hour': len(results) / elapsed * 3600 if elapsed > 0 else 0.0,
+        'mean_case_seconds': sum(r['seconds'] for r in results) / len(results) if results else 0.0,
+        'models': {
+            name: {'calls': model.calls, 'busy_seconds': model.busy_time,
+                   'utilization': model.busy_time / elapsed if elapsed > 0 else 0.0}
+            for name, model in [('lmm', lmm), ('t2i', t2i), ('i23d', i23d)]
+        },
+        'lmm_cache': {'hits': lmm.hits, 'misses': lmm.misses} if args.lmm_cache else None,
+        'results': sorted(results, key=lambda r: r['case']),
+        'failures': failures,
+    }
+    os.makedirs(args.output, exist_ok=True)
+    with open(os.path.join(args.output, 'batch_summary.json'), 'w') as f:
+        json.dump(summary, f, indent=2)
+    log(f'finished {len(results)}/{len(case_dirs)} cases in {elapsed:.1f}s '
+        f'({summary["cases_per_hour"]:.1f} cases/hour), summary in {args.output}/batch_summary.json')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the Idea-to-3D pipeline on many cases with shared models.')
+    parser.add_argument('--dataset', type=str, default='dataset', help='Folder holding the case folders.')
+    parser.add_argument('--cases', type=str, default='case_*', help='Glob of case folders inside --dataset.')
+    parser.add_argument('--output', type=str, default='output/batch', help='Outputs go to {output}/{case}.')
+    parser.add_argument('--num-img', type=int, default=1)
+    parser.add_argument('--num-draft', type=int, default=3)
+    parser.add_argument('--max-iters', type=int, default=5)
+    parser.add_argument('--concurrency', type=int, default=3, help='Number of cases in flight.')
+    parser.add_argument('--no-resume', action='store_true',
+                        help='Ignore the {output}/{case}/manifest.json checkpoints of earlier runs.')
+    parser.add_argument('--lmm', type=str, default='llava-34b', choices=['llava-34b', 'llava-7b', 'gpt4v'])
+    parser.add_argument('--lmm-path', type=str, default=None)
+    parser.add_argument('--lmm-gpu', type=int, default=0)
+    parser.add_argument('--lmm-cache', type=str, default=None,
+                        help='SQLite file caching LMM answers across runs (off when not given).')
+    parser.add_argument('--lmm-cache-mb', type=int, default=256)
+    parser.add_argument('--cache-sampled', action='store_true',
+                        help='Also cache sampled LMM answers (the draft prompts), replaying them on later runs.')
+    parser.add_argument('--openai-key', type=str, default=os.environ.get('OPENAI_API_KEY', ''))
+    parser.add_argument('--t2i', type=str, default='sdxl', choices=['sdxl', 'sdxl-replicate'])
+    parser.add_argument('--sdxl-base-path', type=str, default='stabilityai/stable-diffusion-xl-base-1.0')
+    parser.add_argument('--sdxl-refiner-path', type=str, default='stabilityai/stable-diffusion-xl-refiner-1.0')
+    parser.add_argument('--t2i-gpu', type=int, default=1)
+    parser.add_argument('--t2i-batch-size', type=int, default=1, help='Prompts drawn per T2I call.')
+    parser.add_argument('--replicate-key', type=str, default=os.environ.get('REPLICATE_API_TOKEN', ''))
+    parser.add_argument('--remote-concurrency', type=int, default=8,
+                        help='Requests in flight per batch call to the GPT4V and replicate APIs.')
+    parser.add_argument('--i23d-path', type=str, default='stabilityai/TripoSR')
+    parser.add_argument('--i23d-gpu', type=int, default=2)
+    main(parser.parse_args())
@@ -0,0 +1,129 @@
+import asyncio
+import json
+import random
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# (connect, read) seconds; LMM answers and SDXL predictions can take a while to come back
+DEFAULT_TIMEOUT = (10, 180)
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def make_session(pool_size=16, retries=5, backoff_factor=1.0):
+    """A `requests.Session` with keep-alive pooling and retries.
+
+    Connection errors and 429/5xx answers are retried up to `retries` times
+    with exponential backoff (`backoff_factor * 2**n` seconds, or the server's
+    Retry-After). POST is retried too: the remote APIs used here are stateless.
+    """
+    retry = Retry(total=retries, backoff_factor=backoff_factor, status_forcelist=RETRY_STATUS,
+                  allowed_methods=None, respect_retry_after_header=True, raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_session():
+    # one pooled session shared by every remote wrapper of the process
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = make_session()
+        return _session
+
+
+def post_json(url, payload, headers=None, session=None, timeout=DEFAULT_TIMEOUT):
+    response = (session or get_session()).post(url, headers=headers, json=payload, timeout=timeout)
+    response.raise_for_status()
+    return response.json()
+
+
+def get_bytes(url, session=None, timeout=DEFAULT_TIMEOUT):
+    response = (session or get_session()).get(url, timeout=timeout)
+    response.raise_for_status()
+    return response.content
+
+
+class AsyncHTTP():
+    """asyncio counterpart of the pooled session, on top of aiohttp.
+
+    One `aiohttp.ClientSession` (at most `pool_size` connections) per event
+    loop; requests that fail to connect or answer 429/5xx are retried with
+    exponential backoff and jitter, honouring Retry-After. A session is closed
+    when its loop is shut down by `asyncio.run` (which cancels leftover tasks)
+    or by `close()`, and forgotten once its loop is closed.
+    """
+
+    def __init__(self, pool_size=16, retries=5, backoff_factor=1.0, timeout=DEFAULT_TIMEOUT):
+        self.pool_size = pool_size
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.timeout = timeout
+        self.sessions = {}
+
+    def session(self):
+        import aiohttp
+
+        loop = asyncio.get_running_loop()
+        # sessions of closed loops can neither be used nor closed any more
+        for closed_loop in [other for other in self.sessions if other.is_closed()]:
+            del self.sessions[closed_loop]
+        if loop not in self.sessions or self.sessions[loop][0].closed:
+            if loop in self.sessions:
+                self.sessions[loop][1].cancel()
+            connect, read = self.timeout
+            session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+                timeout=aiohttp.ClientTimeout(sock_connect=connect, sock_read=read))
+            self.sessions[loop] = session, loop.create_task(self.close_on_shutdown(session))
+        return self.sessions[loop][0]
+
+    @staticmethod
+    async def close_on_shutdown(session):
+        # waits until cancelled, as asyncio.run does with leftover tasks before closing the loop
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await session.close()
+
+    async def request(self, method, url, **kwargs):
+        import aiohttp
+
+        for attempt in range(self.retries + 1):
+            delay = self.backoff_factor * 2 ** attempt * (0.5 + random.random() / 2)
+            try:
+                async with self.session().request(method, url, **kwargs) as response:
+                    if response.status in RETRY_STATUS and attempt < self.retries:
+                        retry_after = response.headers.get('Retry-After', '')
+                        if retry_after.isdigit():
+                            delay = float(retry_after)
+                    else:
+                        response.raise_for_status()
+                        return await response.read()
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if attempt == self.retries:
+                    raise
+            await asyncio.sleep(delay)
+
+    async def post_json(self, url, payload, headers=None):
+        return json.loads(await self.request('POST', url, headers=headers, json=payload))
+
+    async def get_bytes(self, url):
+        return await self.request('GET', url)
+
+    async def close(self):
+        # closes the session of the running loop; the others belong to loops this one cannot drive
+        entry = self.sessions.pop(asyncio.get_running_loop(), None)
+        if entry is not None:
+            session, closer = entry
+            closer.cancel()
+            await session.close()
+
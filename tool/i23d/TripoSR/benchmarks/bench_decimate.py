@@ -0,0 +1,69 @@
+"""Runtime of `tsr.decimate.decimate` on extracted meshes.
+
+    python benchmarks/bench_decimate.py                 # the sample drafts in output/
+    python benchmarks/bench_decimate.py output/0/mesh.obj --target-faces 50000 20000 5000
+    python benchmarks/bench_decimate.py --synthetic     # 327k-face mesh, a full 256^3 extraction
+
+Besides the runtime, boundary and non-manifold edges are counted before and
+after: the sample drafts are already open, so `watertight=False` on them says
+nothing about the decimation.
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+import numpy as np
+import trimesh
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_mesh_io import SAMPLE_MESHES, synthetic_mesh
+from tsr.decimate import decimate
+
+
+def edge_counts(faces):
+    # (boundary edges, non-manifold edges): edges used by one face, and by more than two
+    edges = np.sort(np.asarray(faces)[:, [0, 1, 1, 2, 2, 0]].reshape(-1, 2), axis=1)
+    _, counts = np.unique(edges, axis=0, return_counts=True)
+    return int((counts == 1).sum()), int((counts > 2).sum())
+
+
+def main(args):
+    paths = args.meshes or ([] if args.synthetic else sorted(glob.glob(SAMPLE_MESHES)))
+    meshes = [(os.path.relpath(path), trimesh.load(path, process=False)) for path in paths]
+    if args.synthetic or not meshes:
+        meshes.append(("synthetic", synthetic_mesh()))
+    for name, mesh in meshes:
+        colors = mesh.visual.vertex_colors if mesh.visual.kind == "vertex" else None
+        boundary, non_manifold = edge_counts(mesh.faces)
+        print(
+            f"{name}: {len(mesh.vertices)} vertices, {len(mesh.faces)} faces, "
+            f"{boundary} boundary / {non_manifold} non-manifold edges, watertight={mesh.is_watertight}"
+        )
+        for target_faces in args.target_faces:
+            if target_faces >= len(mesh.faces):
+                continue
+            times = []
+            for _ in range(args.repeats):
+                start_time = time.time()
+                out = decimate(mesh.vertices, mesh.faces, colors, target_faces=target_faces)
+                times.append((time.time() - start_time) * 1000)
+            result = trimesh.Trimesh(vertices=out["vertices"], faces=out["faces"], process=False)
+            boundary, non_manifold = edge_counts(out["faces"])
+            print(
+                f"  -> {len(out['faces']):7d} faces (target {target_faces:7d}) in {min(times):9.1f}ms "
+                f"(best of {args.repeats}), {boundary} boundary / {non_manifold} non-manifold edges, "
+                f"watertight={result.is_watertight}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("meshes", type=str, nargs="*", help="Paths to extracted meshes (default: the sample drafts).")
+    parser.add_argument("--synthetic", action="store_true", help="Time the synthetic 327k-face mesh instead.")
+    parser.add_argument("--target-faces", type=int, nargs="+", default=[100000, 20000, 5000],
+                        help="Targets at or above a mesh's face count are skipped.")
+    parser.add_argument("--repeats", type=int, default=3)
+    main(parser.parse_args())
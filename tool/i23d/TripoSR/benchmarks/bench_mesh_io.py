@@ -0,0 +1,60 @@
+"""Write time and file size of the mesh formats supported by `tsr.mesh_io`.
+
+    python benchmarks/bench_mesh_io.py                 # the sample drafts in output/
+    python benchmarks/bench_mesh_io.py output/0/mesh.obj
+    python benchmarks/bench_mesh_io.py --synthetic     # 327k-face mesh, a full 256^3 extraction
+"""
+import argparse
+import glob
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import trimesh
+
+TRIPOSR_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(TRIPOSR_DIR)
+
+from tsr.mesh_io import write_mesh
+
+# meshes extracted by the pipeline for the sample case checked into the repository
+SAMPLE_MESHES = os.path.normpath(
+    os.path.join(TRIPOSR_DIR, "..", "..", "..", "output", "case1-0410-llava-34b", "draft", "iter-*", "mesh.obj"))
+
+
+def synthetic_mesh(subdivisions=7):
+    # about the size of a 256^3 marching-cubes extraction, with vertex colors
+    mesh = trimesh.creation.icosphere(subdivisions=subdivisions)
+    rng = np.random.default_rng(0)
+    vertices = mesh.vertices + rng.normal(scale=1e-3, size=mesh.vertices.shape)
+    colors = rng.random((len(vertices), 3)).astype(np.float32)
+    return trimesh.Trimesh(vertices=vertices, faces=mesh.faces, vertex_colors=colors, process=False)
+
+
+def main(args):
+    paths = args.meshes or ([] if args.synthetic else sorted(glob.glob(SAMPLE_MESHES)))
+    meshes = [(os.path.relpath(path), trimesh.load(path, process=False)) for path in paths]
+    if args.synthetic or not meshes:
+        meshes.append(("synthetic", synthetic_mesh()))
+    out_dir = tempfile.mkdtemp()
+    for name, mesh in meshes:
+        print(f"{name}: {len(mesh.vertices)} vertices, {len(mesh.faces)} faces")
+        for ext, quantize in [("obj", False), ("ply", False), ("glb", False), ("glb", True)]:
+            path = os.path.join(out_dir, f"mesh.{ext}")
+            times = []
+            for _ in range(args.repeats):
+                start_time = time.time()
+                size = write_mesh(path, mesh, quantize=quantize)
+                times.append((time.time() - start_time) * 1000)
+            label = f"{ext}{' (quantized)' if quantize else ''}"
+            print(f"  {label:<16} {min(times):8.1f}ms {size / 1024**2:8.2f}MB (best of {args.repeats})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("meshes", type=str, nargs="*", help="Paths to extracted meshes (default: the sample drafts).")
+    parser.add_argument("--synthetic", action="store_true", help="Time the synthetic 327k-face mesh instead.")
+    parser.add_argument("--repeats", type=int, default=3)
+    main(parser.parse_args())
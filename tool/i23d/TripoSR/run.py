@@ -11,12 +11,13 @@ if current_dir not in sys.path:
     sys.path.append(current_dir)
     
 import numpy as np
-import rembg
 import torch
 from PIL import Image
 
+from tsr.autotune import ChunkSizeAutotuner
+from tsr.cache import SceneCodeCache
 from tsr.system import TSR
-from tsr.utils import remove_background, resize_foreground, save_video
+from tsr.utils import AsyncWriter, BackgroundRemover
 
 
 class Timer:
@@ -40,56 +41,214 @@ class Timer:
         delta = time.time() - start_time
         t = delta * self.time_scale
         logging.info(f"{name} finished in {t:.2f}{self.time_unit}.")
+        return t
+
+
+class TripoSREngine:
+    """Keeps the TSR model and the rembg sessions resident on one device.
+
+    Loading is paid once in the constructor (`load_time`, ms); every call to
+    `inference` only runs preprocessing, the model, rendering and export
+    (`last_call_time`, ms). `chunk_size="auto"` benchmarks separate chunk
+    sizes for rendering and mesh extraction (see `tsr.autotune`). `close()`
+    (or leaving a `with` block) drains the writer and stops the rembg and
+    writer pools.
+    """
+
+    def __init__(self, gpuid, model_path, chunk_size=8192, estimator="dense", termination_threshold=0.0,
+                 mc_resolution=256, mc_method="dense", weight_name="model.ckpt", low_cpu_mem_usage=True,
+                 scene_code_cache_dir=None, scene_code_cache_bytes=4 * 1024**3, rembg_workers=1,
+                 rembg_processes=False, isosurface_chunk_size=None, autotune_cache=None, writer_workers=2,
+                 writer_queue_size=32, mesh_format="obj", mesh_quantize=False, target_faces=None,
+                 cache_backbone_prefix=True, backbone_memory_budget=None, autotune_batch_size=3):
+        logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO)
+        self.timer = Timer()
+        self.mc_resolution = mc_resolution
+        self.mc_method = mc_method
+        # "ply" and "glb" are written by the binary writers in tsr.mesh_io
+        assert mesh_format in ["obj", "ply", "glb"]
+        self.mesh_name = f"mesh.{mesh_format}"
+        self.mesh_quantize = mesh_quantize
+        # decimate meshes to about this many faces before writing them (None keeps full density)
+        self.target_faces = target_faces
+        self.device = f"cuda:{gpuid}" if torch.cuda.is_available() else "cpu"
+
+        self.timer.start("Loading engine")
+        self.model = TSR.from_pretrained(pretrained_model_name_or_path=model_path,
+                                         config_name="config.yaml",
+                                         weight_name=weight_name,
+                                         low_cpu_mem_usage=low_cpu_mem_usage)
+        self.model.backbone.enable_prefix_cache(cache_backbone_prefix)
+        self.model.backbone.set_memory_budget(backbone_memory_budget)
+        self.model.renderer.set_estimator(estimator)
+        self.model.renderer.set_early_termination(termination_threshold)
+        self.model.to(self.device)
+        if chunk_size == "auto":
+            # benchmarked once per device and model config, then read back
+            # tuned on the vectorized render of autotune_batch_size drafts x 6 views that inference_batch does
+            autotuner = ChunkSizeAutotuner(batch_size=autotune_batch_size, n_views=6, render_size=256,
+                                           **({"cache_path": autotune_cache} if autotune_cache else {}))
+            autotuner.apply(self.model, self.device)
+        else:
+            self.model.renderer.set_chunk_size(chunk_size)
+            self.model.renderer.set_isosurface_chunk_size(isosurface_chunk_size)
+        self.background_remover = BackgroundRemover(num_workers=rembg_workers, use_processes=rembg_processes)
+        self.writer = AsyncWriter(num_workers=writer_workers, max_queue_size=writer_queue_size)
+        self.scene_code_cache = (
+            SceneCodeCache(scene_code_cache_dir, max_bytes=scene_code_cache_bytes)
+            if scene_code_cache_dir is not None
+            else None
+        )
+        # hashed on the first scene-code cache lookup, so loads without a cache never read the weights
+        self.weights_fingerprint = None
+        self.load_time = self.timer.end("Loading engine")
+        self.last_call_time = None
+
+    def close(self):
+        # the rembg pool is shut down even when a pending write failed
+        try:
+            self.writer.close()
+        finally:
+            self.background_remover.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def preprocess(self, png_paths, output_dirs, no_remove_bg=False):
+        # background removal runs concurrently on the pooled rembg sessions
+        if no_remove_bg:
+            images = [Image.open(png_path).convert("RGB") for png_path in png_paths]
+        else:
+            images = self.background_remover([Image.open(png_path) for png_path in png_paths])
+        for image, output_dir in zip(images, output_dirs):
+            image.save(os.path.join(output_dir, "input.png"))
+        return [np.array(image) for image in images] if no_remove_bg else images
+
+    def inference(self, png_path, output_dir, render=True, no_remove_bg=False, wait=True):
+        mesh_paths = self.inference_batch([png_path], [output_dir], render=render, no_remove_bg=no_remove_bg,
+                                          wait=wait)
+        return mesh_paths[0]
+
+    def inference_batch(self, png_paths, output_dirs, render=True, no_remove_bg=False, max_batch_size=8,
+                        wait=True):
+        """Lift several drafts at once.
+
+        Preprocessing is per image, the image tokenizer and the backbone run on
+        up to `max_batch_size` images in one forward pass, and rendering and
+        mesh export fan out per draft. Returns one mesh path per input (None
+        for inputs that are not files).
+
+        Renders, videos and meshes are written by `self.writer` in the
+        background; with `wait=False` the call returns before they are on disk
+        and callers use `self.writer.wait(paths)` when they need a file.
+        """
+        assert len(png_paths) == len(output_dirs)
+        timer = self.timer
+        mesh_paths = [None] * len(png_paths)
+        todo = []
+        for idx, (png_path, output_dir) in enumerate(zip(png_paths, output_dirs)):
+            if not os.path.isfile(png_path):
+                logging.error(f"Provided path is not a file: {png_path}")
+                continue
+            os.makedirs(output_dir, exist_ok=True)
+            todo.append(idx)
+        if len(todo) == 0:
+            return mesh_paths
+        timer.start("Inference")
+
+        for b in range(0, len(todo), max_batch_size):
+            batch = todo[b : b + max_batch_size]
+
+            timer.start("Processing images")
+            images = self.preprocess([png_paths[idx] for idx in batch], [output_dirs[idx] for idx in batch],
+                                     no_remove_bg)
+            timer.end("Processing images")
+
+            scene_codes = self.run_model(images)
+
+            self.export(scene_codes, [output_dirs[idx] for idx in batch], render=render)
+            for idx in batch:
+                mesh_paths[idx] = os.path.join(output_dirs[idx], self.mesh_name)
+
+        if wait:
+            self.writer.flush()
+        self.last_call_time = timer.end("Inference")
+        writer_stats = self.writer.stats()
+        logging.info(
+            f"Engine load {self.load_time:.2f}{timer.time_unit}, "
+            f"this call {self.last_call_time:.2f}{timer.time_unit} for {len(todo)} image(s); "
+            f"writer queue depth {writer_stats['queue_depth']} (max {writer_stats['max_queue_depth']}), "
+            f"{writer_stats['written']} file(s) in {writer_stats['write_time_ms']:.2f}ms."
+        )
+        return mesh_paths
+
+    def run_model(self, images):
+        # scene codes for a batch of preprocessed images; with a scene-code cache
+        # only the cache misses go through the tokenizer and the backbone
+        timer = self.timer
+        keys = [None] * len(images)
+        scene_codes = [None] * len(images)
+        if self.scene_code_cache is not None:
+            if self.weights_fingerprint is None:
+                self.weights_fingerprint = self.scene_code_cache.fingerprint(*self.model.weight_files)
+            for idx, image in enumerate(images):
+                keys[idx] = self.scene_code_cache.key(image, self.weights_fingerprint)
+                scene_codes[idx] = self.scene_code_cache.get_tensor(keys[idx], self.device)
+        misses = [idx for idx, scene_code in enumerate(scene_codes) if scene_code is None]
+
+        if len(misses) > 0:
+            timer.start(f"Running model (batch of {len(misses)})")
+            with torch.no_grad():
+                computed = self.model([images[idx] for idx in misses], device=self.device)
+            timer.end(f"Running model (batch of {len(misses)})")
+            for idx, scene_code in zip(misses, computed):
+                scene_codes[idx] = scene_code
+                if self.scene_code_cache is not None:
+                    self.scene_code_cache.put(keys[idx], scene_code)
+        if len(misses) < len(images):
+            logging.info(f"Scene-code cache hits: {len(images) - len(misses)}/{len(images)}.")
+        return torch.stack(scene_codes, dim=0)
+
+    def reexport(self, output_dirs, render=True):
+        """Re-render and re-mesh drafts from their cached scene codes.
+
+        Uses the preprocessed `input.png` written by a previous `inference` call,
+        so neither background removal nor the backbone runs on a cache hit.
+        """
+        images = [np.array(Image.open(os.path.join(output_dir, "input.png")).convert("RGB"))
+                  for output_dir in output_dirs]
+        scene_codes = self.run_model(images)
+        self.export(scene_codes, output_dirs, render=render)
+        self.writer.flush()
+        return [os.path.join(output_dir, self.mesh_name) for output_dir in output_dirs]
+
+    def export(self, scene_codes, output_dirs, render=True):
+        timer = self.timer
+        if render:
+            timer.start("Rendering")
+            render_images = self.model.render(scene_codes, n_views=6, return_type="pil", vectorized=True)
+            for images, output_dir in zip(render_images, output_dirs):
+                for ri, render_image in enumerate(images):
+                    self.writer.save_image(render_image, os.path.join(output_dir, f"render_{ri:03d}.png"))
+                self.writer.save_video(images, os.path.join(output_dir, "render.mp4"), fps=30)
+            timer.end("Rendering")
+
+        timer.start("Exporting mesh")
+        meshes = self.model.extract_mesh(scene_codes, resolution=self.mc_resolution, method=self.mc_method,
+                                         output="trimesh" if self.mesh_name == "mesh.obj" else "arrays",
+                                         target_faces=self.target_faces)
+        for mesh, output_dir in zip(meshes, output_dirs):
+            self.writer.save_mesh(mesh, os.path.join(output_dir, self.mesh_name), quantize=self.mesh_quantize)
+        timer.end("Exporting mesh")
 
-def TripoSRmain(gpuid, model_path, png_path, output_dir, render=True, no_remove_bg = False):
-    timer = Timer()
-    
-    logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO)
-    device = f"cuda:{gpuid}" if torch.cuda.is_available() else "cpu"
-    
-    os.makedirs(output_dir, exist_ok=True)
-
-    timer.start("Initializing model")
-    model = TSR.from_pretrained(pretrained_model_name_or_path=model_path,
-                                config_name="config.yaml",
-                                weight_name="model.ckpt")
-    model.renderer.set_chunk_size(8192)
-    model.to(device)
-    timer.end("Initializing model")
-
-    timer.start("Processing image")
-    if not os.path.isfile(png_path):
-        logging.error(f"Provided path is not a file: {png_path}")
-        return  
-
-    if no_remove_bg:
-        image = np.array(Image.open(png_path).convert("RGB"))
-    else:
-        rembg_session = rembg.new_session()
-        image = remove_background(Image.open(png_path), rembg_session)
-        image = resize_foreground(image, 0.85)
-        image = np.array(image).astype(np.float32) / 255.0
-        image = image[:, :, :3] * image[:, :, 3:4] + (1 - image[:, :, 3:4]) * 0.5
-        image = Image.fromarray((image * 255.0).astype(np.uint8))
-        image.save(os.path.join(output_dir, "input.png"))
-    timer.end("Processing image")
-
-    logging.info("Running model ...")
-    timer.start("Running model")
-    with torch.no_grad():
-        scene_codes = model([image], device=device)
-    timer.end("Running model")
-
-    if render:
-        timer.start("Rendering")
-        render_images = model.render(scene_codes, n_views=6, return_type="pil")
-        for ri, render_image in enumerate(render_images[0]):
-            render_image.save(os.path.join(output_dir, f"render_{ri:03d}.png"))
-        save_video(render_images[0], os.path.join(output_dir, "render.mp4"), fps=30)
-        timer.end("Rendering")
-
-    timer.start("Exporting mesh")
-    meshes = model.extract_mesh(scene_codes, resolution=256)    
-    meshes[0].export(os.path.join(output_dir, "mesh.obj"))
-    timer.end("Exporting mesh")
 
+def TripoSRmain(gpuid, model_path, png_path, output_dir, render=True, no_remove_bg = False):
+    # one-shot entry point; long-running callers should keep a TripoSREngine instead.
+    # png_path / output_dir may also be equal-length lists to lift several drafts in one pass.
+    with TripoSREngine(gpuid, model_path) as engine:
+        if isinstance(png_path, (list, tuple)):
+            return engine.inference_batch(png_path, output_dir, render=render, no_remove_bg=no_remove_bg)
+        return engine.inference(png_path, output_dir, render=render, no_remove_bg=no_remove_bg)
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# tests import the `tsr` package the way run.py does
+triposr_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if triposr_dir not in sys.path:
+    sys.path.append(triposr_dir)
@@ -0,0 +1,28 @@
+import time
+
+import pytest
+
+from tsr.utils import AsyncWriter
+
+
+def test_flush_waits_for_every_write_after_a_failure(tmp_path):
+    writer = AsyncWriter(num_workers=2, max_queue_size=8)
+    written = []
+
+    def write(path, delay, fail):
+        time.sleep(delay)
+        if fail:
+            raise IOError(f"cannot write {path}")
+        written.append(path)
+
+    for n in range(6):
+        path = str(tmp_path / f"{n}.png")
+        writer.submit(path, write, path, 0.05 * n, fail=n in (0, 3))
+
+    with pytest.raises(IOError, match="0.png"):
+        writer.flush()
+    # the writes still outstanding at the first error were waited for
+    assert len(written) == 4
+    assert writer.pending == {}
+    writer.flush()
+    writer.close()
@@ -0,0 +1,29 @@
+import os
+
+from tsr.cache import SceneCodeCache, weights_fingerprint
+
+
+def test_weights_fingerprint_follows_contents(tmp_path):
+    model_dir = tmp_path / "model"
+    model_dir.mkdir()
+    path = str(model_dir / "model.ckpt")
+    with open(path, "wb") as f:
+        f.write(b"weights" * 1000)
+    cache = SceneCodeCache(str(tmp_path / "scene_codes"))
+    fingerprint = cache.fingerprint(path)
+    # the digest is memoized in the cache directory, never next to the weights
+    assert os.listdir(model_dir) == ["model.ckpt"]
+    assert len(os.listdir(tmp_path / "scene_codes" / "digests")) == 1
+    assert weights_fingerprint(path) == fingerprint
+
+    # touching or re-downloading identical weights keeps the fingerprint
+    os.utime(path)
+    assert cache.fingerprint(path) == fingerprint
+
+    # new contents written in place with the old mtime are still noticed
+    stat = os.stat(path)
+    with open(path, "wb") as f:
+        f.write(b"Weights" * 1000)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert cache.fingerprint(path) != fingerprint
+    assert os.listdir(model_dir) == ["model.ckpt"]
@@ -0,0 +1,50 @@
+import numpy as np
+import trimesh
+
+from tsr.decimate import decimate
+
+
+def test_decimate_keeps_closed_surfaces_manifold():
+    mesh = trimesh.creation.icosphere(subdivisions=5)
+    rng = np.random.default_rng(0)
+    vertices = mesh.vertices + rng.normal(scale=1e-3, size=mesh.vertices.shape)
+    colors = rng.integers(0, 256, size=(len(vertices), 4), dtype=np.uint8)
+
+    out = decimate(vertices, mesh.faces, colors, target_faces=2048)
+    result = trimesh.Trimesh(out["vertices"], out["faces"], process=False)
+    assert len(out["faces"]) <= 2048
+    assert result.is_watertight
+    assert result.is_winding_consistent
+    assert out["vertex_colors"].dtype == np.uint8
+    assert len(out["vertex_colors"]) == len(out["vertices"])
+
+
+def boundary_points(mesh):
+    edges = mesh.edges_sorted
+    boundary = edges[trimesh.grouping.group_rows(edges, require_count=1)]
+    return np.unique(mesh.vertices[boundary.reshape(-1)], axis=0)
+
+
+def test_decimate_keeps_boundaries():
+    mesh = trimesh.creation.icosphere(subdivisions=4)
+    # an open hemisphere
+    mesh = mesh.submesh([mesh.triangles_center[:, 2] > 0], append=True)
+
+    out = decimate(mesh.vertices, mesh.faces, target_faces=len(mesh.faces) // 4)
+    result = trimesh.Trimesh(out["vertices"], out["faces"], process=False)
+    assert len(out["faces"]) < len(mesh.faces)
+    np.testing.assert_allclose(
+        boundary_points(result), boundary_points(mesh).astype(np.float32), atol=1e-6
+    )
+
+
+def test_decimate_stops_small_components_at_a_tetrahedron():
+    # a small closed part next to a large one, as marching cubes leaves behind
+    small = trimesh.creation.icosphere(subdivisions=0)
+    large = trimesh.creation.icosphere(subdivisions=3)
+    mesh = trimesh.util.concatenate([small, large.apply_translation([3, 0, 0])])
+
+    out = decimate(mesh.vertices, mesh.faces, target_faces=8)
+    result = trimesh.Trimesh(out["vertices"], out["faces"], process=False)
+    assert result.is_watertight
+    assert sorted(len(part.faces) for part in result.split(only_watertight=False)) == [4, 4]
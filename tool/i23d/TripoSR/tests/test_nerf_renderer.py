@@ -0,0 +1,135 @@
+import pytest
+import torch
+
+from tsr.models.nerf_renderer import TriplaneNeRFRenderer
+from tsr.utils import RayBundleCache
+
+RADIUS = 0.87
+N_VIEWS = 2
+
+
+class SphereDecoder(torch.nn.Module):
+    """Analytic decoder over `coordinate_triplane`s: a soft sphere of radius
+    `sphere_radius` around the origin, colored by position."""
+
+    def __init__(self, sphere_radius=0.5, sharpness=40.0):
+        super().__init__()
+        self.sphere_radius = sphere_radius
+        self.sharpness = sharpness
+
+    def forward(self, features):
+        # concat of the (x, y), (x, z) and (y, z) planes
+        xyz = features[..., [0, 1, 3]] * RADIUS
+        r = xyz.norm(dim=-1, keepdim=True)
+        return {
+            "density": self.sharpness * (self.sphere_radius - r),
+            "features": 3.0 * xyz,
+        }
+
+
+def coordinate_triplane(resolution=64, scale=1.0):
+    # each plane holds its two normalized coordinates, which bilinear sampling
+    # (align_corners=False) reproduces exactly away from the border
+    coords = (torch.arange(resolution) * 2 + 1) / resolution - 1
+    v, u = torch.meshgrid(coords, coords, indexing="ij")
+    plane = torch.stack([u, v], dim=0) * scale
+    return torch.stack([plane, plane, plane], dim=0)  # (Np, Cp, Hp, Wp)
+
+
+def make_renderer(**cfg):
+    return TriplaneNeRFRenderer(
+        {
+            "radius": RADIUS,
+            "density_activation": "exp",
+            "num_samples_per_ray": 64,
+            **cfg,
+        }
+    ).eval()
+
+
+@pytest.fixture(scope="module")
+def rays():
+    bundle = RayBundleCache().get(N_VIEWS, 0.0, 1.9, 40.0, 32, 32, "cpu", RADIUS)
+    return bundle["rays_o"], bundle["rays_d"]
+
+
+def render(renderer, decoder, triplane, rays, occgrid=False):
+    rays_o, rays_d = rays
+    occupancy_grid = (
+        renderer.build_occupancy_grid(decoder, triplane) if occgrid else None
+    )
+    with torch.no_grad():
+        return torch.stack(
+            [
+                renderer(
+                    decoder, triplane, rays_o[i], rays_d[i], occupancy_grid=occupancy_grid
+                )
+                for i in range(N_VIEWS)
+            ]
+        )
+
+
+def test_occgrid_matches_dense(rays):
+    decoder, triplane = SphereDecoder(), coordinate_triplane()
+    dense = render(make_renderer(), decoder, triplane, rays)
+    occgrid = render(make_renderer(estimator="occgrid"), decoder, triplane, rays, occgrid=True)
+    # the sphere is actually rendered, not just background
+    assert dense.min() < 0.5
+    assert (occgrid - dense).abs().max() < 1e-3
+
+
+@pytest.mark.parametrize("occgrid", [False, True])
+def test_march_matches_dense(rays, occgrid):
+    decoder, triplane = SphereDecoder(), coordinate_triplane()
+    dense = render(make_renderer(), decoder, triplane, rays)
+    marched = render(
+        make_renderer(
+            estimator="occgrid" if occgrid else "dense", termination_threshold=1e-3
+        ),
+        decoder,
+        triplane,
+        rays,
+        occgrid=occgrid,
+    )
+    # weights are truncated by at most the threshold per ray
+    assert (marched - dense).abs().max() < 2e-3
+
+
+def test_render_batch_matches_per_view(rays):
+    decoder = SphereDecoder()
+    triplanes = torch.stack([coordinate_triplane(), coordinate_triplane(scale=1.2)])
+    renderer = make_renderer()
+    rays_o, rays_d = rays
+    with torch.no_grad():
+        batched = renderer.render_batch(
+            decoder, triplanes, rays_o, rays_d, ray_chunk_size=500
+        )
+    looped = torch.stack([render(renderer, decoder, triplane, rays) for triplane in triplanes])
+    assert batched.shape == looped.shape
+    assert (batched - looped).abs().max() < 1e-5
+
+
+@pytest.mark.parametrize("chunk_size", [0, 1000])
+def test_occgrid_empty_scene(rays, chunk_size):
+    # density below occgrid_threshold everywhere: no sample reaches the decoder
+    decoder, triplane = SphereDecoder(sphere_radius=-1.0), coordinate_triplane()
+    renderer = make_renderer(estimator="occgrid")
+    renderer.set_chunk_size(chunk_size)
+    occupancy_grid = renderer.build_occupancy_grid(decoder, triplane)
+    assert not occupancy_grid.any()
+    images = render(renderer, decoder, triplane, rays, occgrid=True)
+    assert torch.equal(images, torch.ones_like(images))
+    renderer.set_early_termination(1e-3)
+    images = render(renderer, decoder, triplane, rays, occgrid=True)
+    assert torch.equal(images, torch.ones_like(images))
+
+
+def test_query_triplane_zero_positions():
+    renderer = make_renderer()
+    out = renderer.query_triplane(SphereDecoder(), torch.zeros(0, 3), coordinate_triplane())
+    assert out["density_act"].shape == (0, 1)
+    assert out["color"].shape == (0, 3)
+    out = renderer.query_triplane(
+        SphereDecoder(), torch.zeros(0, 3), coordinate_triplane()[None].repeat(2, 1, 1, 1, 1)
+    )
+    assert out["density_act"].shape == (2, 0, 1)
@@ -0,0 +1,109 @@
+import pytest
+import torch
+
+from tsr.models.transformer.transformer_1d import Transformer1D
+
+
+def make_transformer():
+    torch.manual_seed(0)
+    return Transformer1D(
+        {
+            "in_channels": 32,
+            "num_attention_heads": 2,
+            "attention_head_dim": 16,
+            "num_layers": 2,
+            "cross_attention_dim": 24,
+            "norm_num_groups": 8,
+        }
+    ).eval()
+
+
+@pytest.fixture
+def inputs():
+    torch.manual_seed(1)
+    # one shared token row, as TSR feeds tokenizer(1), and a batch of images
+    return torch.randn(1, 32, 20), torch.randn(3, 7, 24)
+
+
+def test_prefix_cache_matches_uncached(inputs):
+    tokens, encoder_hidden_states = inputs
+    transformer = make_transformer()
+    with torch.no_grad():
+        uncached = transformer(
+            tokens.expand(3, -1, -1), encoder_hidden_states=encoder_hidden_states
+        )
+        transformer.enable_prefix_cache()
+        cached = transformer(tokens, encoder_hidden_states=encoder_hidden_states)
+        # the second call is served from the cache
+        assert transformer._prefix_cache is not None
+        cached_again = transformer(tokens, encoder_hidden_states=encoder_hidden_states)
+    assert cached.shape == uncached.shape
+    assert torch.allclose(cached, uncached, atol=1e-6)
+    assert torch.equal(cached, cached_again)
+
+
+def test_prefix_cache_follows_weight_updates(inputs):
+    tokens, encoder_hidden_states = inputs
+    transformer = make_transformer()
+    transformer.enable_prefix_cache()
+    with torch.no_grad():
+        transformer(tokens, encoder_hidden_states=encoder_hidden_states)
+        transformer.proj_in.weight.mul_(2)
+        cached = transformer(tokens, encoder_hidden_states=encoder_hidden_states)
+        transformer.enable_prefix_cache(False)
+        uncached = transformer(
+            tokens.expand(3, -1, -1), encoder_hidden_states=encoder_hidden_states
+        )
+    assert torch.allclose(cached, uncached, atol=1e-6)
+
+
+def test_memory_budget_matches_default_processors(inputs):
+    tokens, encoder_hidden_states = inputs
+    tokens = tokens.expand(3, -1, -1)
+    transformer = make_transformer()
+    with torch.no_grad():
+        reference = transformer(tokens, encoder_hidden_states=encoder_hidden_states)
+        # small enough to slice the queries and chunk the feed-forward
+        transformer.set_memory_budget(4096)
+        sliced = transformer(tokens, encoder_hidden_states=encoder_hidden_states)
+        assert transformer._sliced_processor.slice_size is not None
+        assert torch.allclose(sliced, reference, atol=1e-5)
+
+        # fused weights follow in-place updates of the projections
+        attn1 = transformer.transformer_blocks[0].attn1
+        attn2 = transformer.transformer_blocks[0].attn2
+        attn1.to_q.weight.mul_(2)
+        attn2.to_v.weight.mul_(0.5)
+        sliced = transformer(tokens, encoder_hidden_states=encoder_hidden_states)
+        transformer.set_memory_budget(None)
+        reference = transformer(tokens, encoder_hidden_states=encoder_hidden_states)
+    assert torch.allclose(sliced, reference, atol=1e-5)
+
+
+def test_fused_projections_stay_out_of_state_dict():
+    transformer = make_transformer()
+    keys = set(transformer.state_dict())
+    transformer.set_memory_budget(4096)
+    assert set(transformer.state_dict()) == keys
+    # a checkpoint saved while fused loads strictly into a fresh model
+    make_transformer().load_state_dict(transformer.state_dict())
+
+
+@pytest.mark.parametrize("scale_qk", [True, False])
+def test_fused_sliced_processor_matches_attn_processor(scale_qk):
+    from tsr.models.transformer.attention import (
+        Attention,
+        AttnProcessor,
+        FusedSlicedAttnProcessor,
+    )
+
+    torch.manual_seed(0)
+    attn = Attention(32, heads=2, dim_head=16, bias=True, scale_qk=scale_qk).eval()
+    hidden_states = torch.randn(2, 32, 4, 5)  # 4-D (batch, channel, height, width)
+    with torch.no_grad():
+        attn.set_processor(AttnProcessor())
+        reference = attn(hidden_states)
+        attn.set_processor(FusedSlicedAttnProcessor(slice_size=8))
+        sliced = attn(hidden_states)
+    assert sliced.shape == hidden_states.shape
+    assert torch.allclose(sliced, reference, atol=1e-5)
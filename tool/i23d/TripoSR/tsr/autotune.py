@@ -0,0 +1,202 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Callable, Dict, Optional, Sequence
+
+import torch
+from omegaconf import OmegaConf
+
+DEFAULT_CANDIDATES = (2048, 4096, 8192, 16384, 32768, 65536, 131072)
+DEFAULT_CACHE_PATH = os.path.join(
+    os.path.expanduser("~"), ".cache", "tsr", "chunk_sizes.json"
+)
+
+
+def device_signature(device: str) -> str:
+    device = torch.device(device)
+    if device.type == "cuda":
+        props = torch.cuda.get_device_properties(device)
+        return f"{props.name}:{props.total_memory}"
+    return device.type
+
+
+def config_signature(model: torch.nn.Module) -> str:
+    cfg = OmegaConf.to_yaml(model.cfg)
+    return hashlib.sha256(cfg.encode()).hexdigest()[:16]
+
+
+class ChunkSizeAutotuner:
+    """Benchmarks renderer chunk sizes and remembers the fastest ones.
+
+    Rendering and the isosurface density query are tuned separately: each
+    candidate in `candidates` is timed on synthetic scene codes, candidates
+    whose peak memory exceeds `memory_budget` bytes (by default 80% of the
+    memory free on the device) are discarded, and the winners are persisted
+    to `cache_path` per device, dtype, model config and workload so tuning
+    happens once. Rendering is timed the way the engine renders: `batch_size`
+    scene codes and `n_views` views of `render_size` pixels in one vectorized
+    pass, where the chunk size is shared by all scene codes. Memory is only
+    measured on CUDA; on other devices every candidate fits.
+    """
+
+    def __init__(
+        self,
+        cache_path: str = DEFAULT_CACHE_PATH,
+        candidates: Sequence[int] = DEFAULT_CANDIDATES,
+        memory_budget: Optional[int] = None,
+        n_repeats: int = 2,
+        render_size: int = 256,
+        n_views: int = 6,
+        batch_size: int = 3,
+        n_query_points: int = 2**20,
+    ):
+        self.cache_path = cache_path
+        self.candidates = sorted(candidates)
+        self.memory_budget = memory_budget
+        self.n_repeats = n_repeats
+        self.render_size = render_size
+        self.n_views = n_views
+        self.batch_size = batch_size
+        self.n_query_points = n_query_points
+
+    def key(self, model: torch.nn.Module, device: str) -> str:
+        dtype = next(model.parameters()).dtype
+        workload = f"{self.batch_size}x{self.n_views}x{self.render_size}"
+        return f"{device_signature(device)}|{dtype}|{config_signature(model)}|{workload}"
+
+    def load(self) -> Dict[str, Dict[str, int]]:
+        if not os.path.isfile(self.cache_path):
+            return {}
+        with open(self.cache_path) as f:
+            return json.load(f)
+
+    def save(self, key: str, chunk_sizes: Dict[str, int]) -> None:
+        entries = self.load()
+        entries[key] = chunk_sizes
+        os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+        tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(entries, f, indent=2)
+        os.replace(tmp_path, self.cache_path)
+
+    def _memory_budget(self, device: torch.device) -> Optional[int]:
+        if self.memory_budget is not None or device.type != "cuda":
+            return self.memory_budget
+        free, _ = torch.cuda.mem_get_info(device)
+        return int(free * 0.8)
+
+    def _benchmark(
+        self, fn: Callable[[], None], device: torch.device
+    ) -> Optional[Dict[str, float]]:
+        is_cuda = device.type == "cuda"
+        try:
+            fn()  # warm-up
+            if is_cuda:
+                torch.cuda.synchronize(device)
+                torch.cuda.reset_peak_memory_stats(device)
+                baseline = torch.cuda.memory_allocated(device)
+            start_time = time.time()
+            for _ in range(self.n_repeats):
+                fn()
+            if is_cuda:
+                torch.cuda.synchronize(device)
+        except torch.cuda.OutOfMemoryError:
+            torch.cuda.empty_cache()
+            return None
+        return {
+            "time": (time.time() - start_time) * 1000 / self.n_repeats,
+            "memory": (
+                torch.cuda.max_memory_allocated(device) - baseline if is_cuda else 0
+            ),
+        }
+
+    def _pick(
+        self,
+        name: str,
+        make_fn: Callable[[int], Callable[[], None]],
+        device: torch.device,
+        budget: Optional[int],
+    ) -> int:
+        best_chunk_size, best_time = None, float("inf")
+        for chunk_size in self.candidates:
+            result = self._benchmark(make_fn(chunk_size), device)
+            if result is None or (budget is not None and result["memory"] > budget):
+                logging.info(f"Autotune {name}: chunk size {chunk_size} exceeds budget.")
+                # larger chunks only need more memory
+                break
+            logging.info(
+                f"Autotune {name}: chunk size {chunk_size} took {result['time']:.2f}ms, "
+                f"peak {result['memory'] / 1024**2:.0f}MB."
+            )
+            if result["time"] < best_time:
+                best_chunk_size, best_time = chunk_size, result["time"]
+        if best_chunk_size is None:
+            best_chunk_size = self.candidates[0]
+        return best_chunk_size
+
+    def tune(self, model: torch.nn.Module, device: str) -> Dict[str, int]:
+        device = torch.device(device)
+        budget = self._memory_budget(device)
+        renderer = model.renderer
+        with torch.no_grad():
+            scene_code = model.post_processor(
+                model.tokenizer.detokenize(model.tokenizer(1))
+            ).to(device)
+            scene_codes = list(scene_code.expand(self.batch_size, *scene_code.shape[1:]))
+            points = (
+                torch.rand(self.n_query_points, 3, device=device) * 2 - 1
+            ) * renderer.cfg.radius
+        chunk_size = renderer.chunk_size
+
+        def make_render_fn(chunk_size):
+            def fn():
+                renderer.set_chunk_size(chunk_size)
+                with torch.no_grad():
+                    model.render(
+                        scene_codes,
+                        n_views=self.n_views,
+                        height=self.render_size,
+                        width=self.render_size,
+                        return_type="pt",
+                        vectorized=True,
+                    )
+
+            return fn
+
+        def make_query_fn(chunk_size):
+            def fn():
+                with torch.no_grad():
+                    renderer.query_triplane(
+                        model.decoder, points, scene_code[0], chunk_size=chunk_size
+                    )
+
+            return fn
+
+        try:
+            chunk_sizes = {
+                "render": self._pick("render", make_render_fn, device, budget),
+                "isosurface": self._pick("isosurface", make_query_fn, device, budget),
+            }
+        finally:
+            renderer.set_chunk_size(chunk_size)
+        return chunk_sizes
+
+    def apply(
+        self, model: torch.nn.Module, device: str, retune: bool = False
+    ) -> Dict[str, int]:
+        """Set the persisted (or freshly tuned) chunk sizes on `model`."""
+        key = self.key(model, device)
+        chunk_sizes = None if retune else self.load().get(key)
+        if chunk_sizes is None:
+            start_time = time.time()
+            chunk_sizes = self.tune(model, device)
+            self.save(key, chunk_sizes)
+            logging.info(
+                f"Autotuned chunk sizes {chunk_sizes} for {key} in "
+                f"{(time.time() - start_time) * 1000:.2f}ms."
+            )
+        model.renderer.set_chunk_size(chunk_sizes["render"])
+        model.renderer.set_isosurface_chunk_size(chunk_sizes["isosurface"])
+        return chunk_sizes
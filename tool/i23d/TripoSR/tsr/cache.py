@@ -0,0 +1,142 @@
+import hashlib
+import os
+from typing import Optional, Union
+
+import numpy as np
+import PIL.Image
+import torch
+
+
+def file_digest(
+    path: str, memo_dir: Optional[str] = None, block_size: int = 16 * 1024**2
+) -> str:
+    """sha256 of a file's contents, memoized in `memo_dir` when one is given.
+
+    The memo is keyed by the file's absolute path and records size, mtime and
+    ctime; the file is re-hashed only when one of them changed (ctime also
+    changes on in-place writes that keep the mtime), so a multi-GB checkpoint
+    is hashed once, and a `touch` or an identical re-download gives back the
+    same digest. Nothing is written next to the file itself, which may live
+    in a read-only or shared model cache.
+    """
+    stat = os.stat(path)
+    signature = f"{stat.st_size}:{stat.st_mtime_ns}:{stat.st_ctime_ns}"
+    memo = None
+    if memo_dir is not None:
+        name = hashlib.sha256(os.path.abspath(path).encode()).hexdigest()
+        memo = os.path.join(memo_dir, f"{name}.sha256")
+        try:
+            with open(memo, "r") as f:
+                cached_signature, digest = f.read().split()
+            if cached_signature == signature:
+                return digest
+        except (OSError, ValueError):
+            pass
+
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    digest = h.hexdigest()
+    if memo is not None:
+        try:
+            os.makedirs(memo_dir, exist_ok=True)
+            tmp_path = f"{memo}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                f.write(f"{signature} {digest}\n")
+            os.replace(tmp_path, memo)
+        except OSError:
+            # hash again on the next load
+            pass
+    return digest
+
+
+def weights_fingerprint(*paths: str, memo_dir: Optional[str] = None) -> str:
+    # identifies a set of model files by their contents, wherever they live
+    h = hashlib.sha256()
+    for path in paths:
+        h.update(f"{file_digest(path, memo_dir)};".encode())
+    return h.hexdigest()
+
+
+class SceneCodeCache:
+    """Content-addressed on-disk store of triplane scene codes.
+
+    Scene codes are keyed by a hash of the preprocessed input image and of the
+    model weights, stored as fp16 `.npy` files that can be memory-mapped, and
+    evicted least-recently-used first once the store exceeds `max_bytes`.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        max_bytes: int = 4 * 1024**3,
+        dtype: np.dtype = np.float16,
+    ):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.dtype = dtype
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def fingerprint(self, *paths: str) -> str:
+        # weights fingerprint with the file digests memoized beside the scene codes
+        return weights_fingerprint(
+            *paths, memo_dir=os.path.join(self.cache_dir, "digests")
+        )
+
+    def key(
+        self,
+        image: Union[PIL.Image.Image, np.ndarray],
+        model_fingerprint: str,
+    ) -> str:
+        image = np.ascontiguousarray(np.asarray(image))
+        h = hashlib.sha256()
+        h.update(model_fingerprint.encode())
+        h.update(f"{image.shape}:{image.dtype};".encode())
+        h.update(image.tobytes())
+        return h.hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.npy")
+
+    def get(self, key: str, mmap: bool = True) -> Optional[np.ndarray]:
+        path = self.path(key)
+        if not os.path.isfile(path):
+            return None
+        # the modification time doubles as the last-access time for eviction
+        os.utime(path)
+        return np.load(path, mmap_mode="r" if mmap else None)
+
+    def get_tensor(self, key: str, device: str) -> Optional[torch.FloatTensor]:
+        scene_code = self.get(key)
+        if scene_code is None:
+            return None
+        return torch.from_numpy(np.array(scene_code)).to(device=device, dtype=torch.float32)
+
+    def put(self, key: str, scene_code: torch.FloatTensor) -> None:
+        path = self.path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, scene_code.detach().cpu().numpy().astype(self.dtype))
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self) -> None:
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".npy"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                pass
+            total -= size
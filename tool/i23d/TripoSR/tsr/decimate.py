@@ -0,0 +1,242 @@
+import logging
+import time
+from typing import Dict, Optional
+
+import numpy as np
+
+
+def face_normals(vertices: np.ndarray, faces: np.ndarray) -> np.ndarray:
+    # unnormalized, their length is twice the face area
+    v0, v1, v2 = vertices[faces[:, 0]], vertices[faces[:, 1]], vertices[faces[:, 2]]
+    return np.cross(v1 - v0, v2 - v0)
+
+
+def vertex_quadrics(vertices: np.ndarray, faces: np.ndarray) -> np.ndarray:
+    """Area-weighted sum of the plane quadrics of the faces around each vertex,
+    as an (Nv, 4, 4) array."""
+    normals = face_normals(vertices, faces)
+    area = np.linalg.norm(normals, axis=-1)
+    n = normals / np.maximum(area, 1e-12)[:, None]
+    planes = np.concatenate([n, -np.einsum("ij,ij->i", n, vertices[faces[:, 0]])[:, None]], axis=-1)
+    K = np.einsum("fi,fj->fij", planes, planes) * (0.5 * area)[:, None, None]
+    Q = np.empty((len(vertices), 16))
+    corners = faces.reshape(-1)
+    for i, k in enumerate(K.reshape(-1, 16).T):
+        Q[:, i] = np.bincount(corners, weights=np.repeat(k, 3), minlength=len(vertices))
+    return Q.reshape(-1, 4, 4)
+
+
+def unique_edges(faces: np.ndarray, n_vertices: int):
+    """Unique (a < b) edges of `faces` and a per-vertex boundary mask."""
+    edges = np.sort(faces[:, [0, 1, 1, 2, 2, 0]].reshape(-1, 2), axis=-1)
+    keys, counts = np.unique(edges[:, 0] * n_vertices + edges[:, 1], return_counts=True)
+    edges = np.stack([keys // n_vertices, keys % n_vertices], axis=-1)
+    boundary = np.zeros(n_vertices, dtype=bool)
+    boundary[edges[counts == 1].reshape(-1)] = True
+    return edges, boundary
+
+
+def common_neighbor_counts(
+    edges: np.ndarray, n_vertices: int, sel: np.ndarray
+) -> np.ndarray:
+    """Number of vertices adjacent to both endpoints of the edges `edges[sel]`.
+
+    `edges` are the sorted unique edges of `unique_edges`. An interior edge can
+    be collapsed without making the surface non-manifold only if this is 2
+    (the link condition): the two opposite vertices.
+    """
+    keys = edges[:, 0] * n_vertices + edges[:, 1]
+    both = np.concatenate([edges, edges[:, ::-1]])
+    both = both[np.argsort(both[:, 0], kind="stable")]
+    starts = np.searchsorted(both[:, 0], np.arange(n_vertices + 1))
+    a, b = edges[sel, 0], edges[sel, 1]
+    # every neighbor w of a, tested for the edge (b, w)
+    degree = starts[a + 1] - starts[a]
+    owner = np.repeat(np.arange(len(sel)), degree)
+    offset = np.arange(len(owner)) - np.repeat(np.cumsum(degree) - degree, degree)
+    w = both[np.repeat(starts[a], degree) + offset, 1]
+    query = np.minimum(b[owner], w) * n_vertices + np.maximum(b[owner], w)
+    pos = np.minimum(np.searchsorted(keys, query), len(keys) - 1)
+    return np.bincount(owner[keys[pos] == query], minlength=len(sel))
+
+
+def decimate(
+    vertices: np.ndarray,
+    faces: np.ndarray,
+    vertex_colors: Optional[np.ndarray] = None,
+    target_faces: Optional[int] = None,
+    max_error: Optional[float] = None,
+    max_iterations: int = 200,
+) -> Dict[str, np.ndarray]:
+    """Quadric-error edge-collapse decimation, vectorized over many edges.
+
+    Each pass scores every edge by the quadric error of its best placement
+    (either endpoint or the midpoint), then collapses at once a set of cheapest
+    edges far enough apart to touch disjoint faces, skipping collapses that
+    would flip a face or break the link condition (and with it the manifold),
+    and never reducing a closed component below a tetrahedron.
+    Passes repeat until the mesh has at most `target_faces` faces or the
+    cheapest collapse costs more than `max_error`. Boundary vertices are kept
+    in place. Vertex colors are interpolated like positions.
+    """
+    if target_faces is None and max_error is None:
+        raise ValueError("decimate needs target_faces or max_error.")
+    target_faces = 0 if target_faces is None else target_faces
+    max_error = np.inf if max_error is None else max_error
+
+    v = np.asarray(vertices, dtype=np.float64).copy()
+    f = np.asarray(faces, dtype=np.int64).copy()
+    colors_dtype = None
+    if vertex_colors is not None:
+        colors_dtype = np.asarray(vertex_colors).dtype
+        c = np.asarray(vertex_colors, dtype=np.float32).copy()
+    Q = vertex_quadrics(v, f)
+    placements = np.array([0.0, 1.0, 0.5])
+    # keys (a * Nv + b) of edges whose collapse flipped a face, retried once an
+    # endpoint has moved
+    blocked = np.zeros(0, dtype=np.int64)
+
+    for _ in range(max_iterations):
+        n_excess = len(f) - target_faces
+        if n_excess <= 0:
+            break
+        edges, boundary = unique_edges(f, len(v))
+        a, b = edges[:, 0], edges[:, 1]
+        keys = a * len(v) + b
+        t_cand = placements[None, :, None]
+        cand = v[a][:, None] * (1 - t_cand) + v[b][:, None] * t_cand  # (E, 3, 3)
+        cand_h = np.concatenate([cand, np.ones_like(cand[..., :1])], axis=-1)
+        err = (np.matmul(cand_h, Q[a] + Q[b]) * cand_h).sum(axis=-1)  # (E, 3)
+        best = err.argmin(axis=-1)
+        cost = err[np.arange(len(edges)), best]
+        t = placements[best]
+        target = cand[np.arange(len(edges)), best]
+
+        idx = np.flatnonzero(
+            (cost <= max_error)
+            & ~boundary[a]
+            & ~boundary[b]
+            & ~np.isin(keys, blocked)
+        )
+        if len(idx) == 0:
+            break
+        idx = idx[np.argsort(cost[idx], kind="stable")]
+        # keep the edges that are the cheapest candidate within the 1-ring of
+        # both endpoints, so that no face is touched by two selected collapses
+        rank = np.arange(len(idx))
+        owner = np.full(len(v), len(idx))
+        np.minimum.at(owner, a[idx], rank)
+        np.minimum.at(owner, b[idx], rank)
+        ring_owner = owner.copy()
+        np.minimum.at(ring_owner, a, owner[b])
+        np.minimum.at(ring_owner, b, owner[a])
+        sel = idx[(ring_owner[a[idx]] == rank) & (ring_owner[b[idx]] == rank)]
+        # collapses that break the link condition are retried after a move;
+        # so are those of a tetrahedron (both endpoints of degree 3), which
+        # would fold a small closed component into a doubled face
+        degree = np.bincount(edges.reshape(-1), minlength=len(v))
+        linked = (common_neighbor_counts(edges, len(v), sel) == 2) & (
+            (degree[a[sel]] > 3) | (degree[b[sel]] > 3)
+        )
+        blocked = np.union1d(blocked, keys[sel[~linked]])
+        sel = sel[linked]
+        if len(sel) == 0:
+            continue
+        # a collapse removes two faces on a closed surface
+        sel = sel[: max(1, (n_excess + 1) // 2)]
+
+        def collapse(sel):
+            new_v = v.copy()
+            new_v[a[sel]] = target[sel]
+            remap = np.arange(len(v))
+            remap[b[sel]] = a[sel]
+            new_f = remap[f]
+            keep = (
+                (new_f[:, 0] != new_f[:, 1])
+                & (new_f[:, 1] != new_f[:, 2])
+                & (new_f[:, 2] != new_f[:, 0])
+            )
+            return new_v, new_f, keep
+
+        new_v, new_f, keep = collapse(sel)
+        moved = np.zeros(len(v), dtype=bool)
+        moved[a[sel]] = moved[b[sel]] = True
+        touched = np.flatnonzero(keep & moved[f].any(axis=-1))
+        n_old = face_normals(v, f[touched])
+        n_new = face_normals(new_v, new_f[touched])
+        flipped = (np.einsum("ij,ij->i", n_old, n_new) <= 0) & (
+            np.linalg.norm(n_old, axis=-1) > 0
+        )
+        if flipped.any():
+            bad = np.zeros(len(v), dtype=bool)
+            bad[f[touched[flipped]].reshape(-1)] = True
+            rejected = bad[a[sel]] | bad[b[sel]]
+            blocked = np.union1d(blocked, keys[sel[rejected]])
+            sel = sel[~rejected]
+            if len(sel) == 0:
+                continue
+            new_v, new_f, keep = collapse(sel)
+
+        blocked = blocked[
+            ~np.isin(blocked // len(v), a[sel]) & ~np.isin(blocked % len(v), a[sel])
+        ]
+        Q[a[sel]] += Q[b[sel]]
+        if vertex_colors is not None:
+            c[a[sel]] = c[a[sel]] * (1 - t[sel, None]) + c[b[sel]] * t[sel, None]
+        v = new_v
+        f = new_f[keep]
+        # the link condition rules out duplicate faces; this only guards
+        # against degenerate input (one int64 key per face, cheaper than axis=0)
+        fs = np.sort(f, axis=-1)
+        n = len(v)
+        if n < 2**21:
+            _, first = np.unique((fs[:, 0] * n + fs[:, 1]) * n + fs[:, 2], return_index=True)
+        else:
+            _, first = np.unique(fs, axis=0, return_index=True)
+        f = f[np.sort(first)]
+
+    used, f = np.unique(f, return_inverse=True)
+    out = {
+        "vertices": v[used].astype(np.float32),
+        "faces": f.reshape(-1, 3).astype(np.int32),
+    }
+    if vertex_colors is not None:
+        c = c[used]
+        if np.issubdtype(colors_dtype, np.integer):
+            c = np.round(c)
+        out["vertex_colors"] = c.astype(colors_dtype)
+    return out
+
+
+def decimate_mesh(mesh, target_faces=None, max_error=None):
+    """Decimate a trimesh or an `extract_mesh(output="arrays")` dict, returning
+    the same kind of object, and log the time taken."""
+    import trimesh
+
+    start_time = time.time()
+    is_trimesh = isinstance(mesh, trimesh.Trimesh)
+    if is_trimesh:
+        colors = mesh.visual.vertex_colors if mesh.visual.kind == "vertex" else None
+        arrays = {"vertices": mesh.vertices, "faces": mesh.faces, "vertex_colors": colors}
+    else:
+        arrays = mesh
+    out = decimate(
+        arrays["vertices"],
+        arrays["faces"],
+        arrays.get("vertex_colors"),
+        target_faces=target_faces,
+        max_error=max_error,
+    )
+    logging.info(
+        f"Decimated {len(arrays['faces'])} -> {len(out['faces'])} faces in "
+        f"{(time.time() - start_time) * 1000:.2f}ms."
+    )
+    if is_trimesh:
+        return trimesh.Trimesh(
+            vertices=out["vertices"],
+            faces=out["faces"],
+            vertex_colors=out.get("vertex_colors"),
+            process=False,
+        )
+    return out
+
@@ -0,0 +1,231 @@
+import json
+import os
+import struct
+from typing import Optional
+
+import numpy as np
+import trimesh
+
+GLB_MAGIC = 0x46546C67
+GLB_CHUNK_JSON = 0x4E4F534A
+GLB_CHUNK_BIN = 0x004E4942
+
+GL_UNSIGNED_BYTE = 5121
+GL_UNSIGNED_SHORT = 5123
+GL_UNSIGNED_INT = 5125
+GL_FLOAT = 5126
+GL_ARRAY_BUFFER = 34962
+GL_ELEMENT_ARRAY_BUFFER = 34963
+
+
+def colors_to_uint8(colors: np.ndarray) -> np.ndarray:
+    # float colors in [0, 1] to uint8, without going through float64
+    colors = np.asarray(colors, dtype=np.float32)
+    return (np.clip(colors[..., :3], 0.0, 1.0) * 255.0 + 0.5).astype(np.uint8)
+
+
+def _mesh_arrays(vertices, faces, colors):
+    vertices = np.ascontiguousarray(vertices, dtype=np.float32)
+    faces = np.ascontiguousarray(faces, dtype=np.int32)
+    if colors is not None:
+        colors = np.asarray(colors)
+        if colors.dtype == np.uint8:
+            colors = np.ascontiguousarray(colors[:, :3])
+        else:
+            colors = colors_to_uint8(colors)
+    return vertices, faces, colors
+
+
+def write_ply(
+    path: str,
+    vertices: np.ndarray,
+    faces: np.ndarray,
+    colors: Optional[np.ndarray] = None,
+) -> None:
+    """Write a binary little-endian PLY with float32 positions, uint8 colors
+    and int32 triangle indices."""
+    vertices, faces, colors = _mesh_arrays(vertices, faces, colors)
+    vertex_fields = [("xyz", "<f4", 3)]
+    header = [
+        "ply",
+        "format binary_little_endian 1.0",
+        f"element vertex {len(vertices)}",
+        "property float x",
+        "property float y",
+        "property float z",
+    ]
+    if colors is not None:
+        vertex_fields.append(("rgb", "u1", 3))
+        header += ["property uchar red", "property uchar green", "property uchar blue"]
+    header += [
+        f"element face {len(faces)}",
+        "property list uchar int vertex_indices",
+        "end_header",
+    ]
+
+    vertex_data = np.empty(len(vertices), dtype=vertex_fields)
+    vertex_data["xyz"] = vertices
+    if colors is not None:
+        vertex_data["rgb"] = colors
+    face_data = np.empty(len(faces), dtype=[("n", "u1"), ("idx", "<i4", 3)])
+    face_data["n"] = 3
+    face_data["idx"] = faces
+
+    with open(path, "wb") as f:
+        f.write(("\n".join(header) + "\n").encode("ascii"))
+        f.write(vertex_data.tobytes())
+        f.write(face_data.tobytes())
+
+
+def _pad4(data: bytes, fill: bytes = b"\x00") -> bytes:
+    return data + fill * (-len(data) % 4)
+
+
+def write_glb(
+    path: str,
+    vertices: np.ndarray,
+    faces: np.ndarray,
+    colors: Optional[np.ndarray] = None,
+    quantize: bool = False,
+) -> None:
+    """Write a single-mesh binary glTF.
+
+    With `quantize`, positions are stored as uint16 on a grid spanning the
+    bounding box and dequantized by the node transform (KHR_mesh_quantization),
+    which shrinks them from 12 to 8 bytes per vertex.
+    """
+    vertices, faces, colors = _mesh_arrays(vertices, faces, colors)
+    buffer_views, accessors, blobs = [], [], []
+    offset = 0
+
+    def add(data: np.ndarray, target: int, byte_stride: Optional[int] = None):
+        nonlocal offset
+        blob = _pad4(data.tobytes())
+        view = {"buffer": 0, "byteOffset": offset, "byteLength": data.nbytes, "target": target}
+        if byte_stride is not None:
+            view["byteStride"] = byte_stride
+        buffer_views.append(view)
+        blobs.append(blob)
+        offset += len(blob)
+        return len(buffer_views) - 1
+
+    node = {"mesh": 0}
+    extensions = []
+    if quantize and len(vertices) > 0:
+        v_min, v_max = vertices.min(axis=0), vertices.max(axis=0)
+        scale = np.maximum(v_max - v_min, 1e-8) / 65535.0
+        q = np.zeros((len(vertices), 4), dtype=np.uint16)  # padded to a 4-byte stride
+        q[:, :3] = np.round((vertices - v_min) / scale)
+        accessors.append(
+            {
+                "bufferView": add(q, GL_ARRAY_BUFFER, byte_stride=8),
+                "componentType": GL_UNSIGNED_SHORT,
+                "count": len(vertices),
+                "type": "VEC3",
+                "min": q[:, :3].min(axis=0).tolist(),
+                "max": q[:, :3].max(axis=0).tolist(),
+            }
+        )
+        node["translation"] = v_min.tolist()
+        node["scale"] = scale.tolist()
+        extensions.append("KHR_mesh_quantization")
+    else:
+        accessors.append(
+            {
+                "bufferView": add(vertices, GL_ARRAY_BUFFER),
+                "componentType": GL_FLOAT,
+                "count": len(vertices),
+                "type": "VEC3",
+                "min": vertices.min(axis=0).tolist() if len(vertices) else [0.0] * 3,
+                "max": vertices.max(axis=0).tolist() if len(vertices) else [0.0] * 3,
+            }
+        )
+    attributes = {"POSITION": 0}
+
+    if colors is not None:
+        # vertex attributes need a 4-byte aligned stride, hence RGBA
+        rgba = np.full((len(colors), 4), 255, dtype=np.uint8)
+        rgba[:, :3] = colors
+        accessors.append(
+            {
+                "bufferView": add(rgba, GL_ARRAY_BUFFER),
+                "componentType": GL_UNSIGNED_BYTE,
+                "normalized": True,
+                "count": len(colors),
+                "type": "VEC4",
+            }
+        )
+        attributes["COLOR_0"] = len(accessors) - 1
+
+    accessors.append(
+        {
+            "bufferView": add(faces.astype(np.uint32).reshape(-1), GL_ELEMENT_ARRAY_BUFFER),
+            "componentType": GL_UNSIGNED_INT,
+            "count": faces.size,
+            "type": "SCALAR",
+        }
+    )
+
+    gltf = {
+        "asset": {"version": "2.0", "generator": "TripoSR"},
+        "scene": 0,
+        "scenes": [{"nodes": [0]}],
+        "nodes": [node],
+        "meshes": [
+            {
+                "primitives": [
+                    {"attributes": attributes, "indices": len(accessors) - 1, "mode": 4}
+                ]
+            }
+        ],
+        "accessors": accessors,
+        "bufferViews": buffer_views,
+        "buffers": [{"byteLength": offset}],
+    }
+    if extensions:
+        gltf["extensionsUsed"] = extensions
+        gltf["extensionsRequired"] = extensions
+
+    json_chunk = _pad4(json.dumps(gltf, separators=(",", ":")).encode(), b" ")
+    bin_chunk = b"".join(blobs)
+    with open(path, "wb") as f:
+        f.write(struct.pack("<III", GLB_MAGIC, 2, 12 + 8 + len(json_chunk) + 8 + len(bin_chunk)))
+        f.write(struct.pack("<II", len(json_chunk), GLB_CHUNK_JSON))
+        f.write(json_chunk)
+        f.write(struct.pack("<II", len(bin_chunk), GLB_CHUNK_BIN))
+        f.write(bin_chunk)
+
+
+def write_mesh(path: str, mesh, quantize: bool = False) -> int:
+    """Write `mesh` (a trimesh or a dict of `vertices`, `faces` and optional
+    `vertex_colors`) in the format given by the extension of `path`.
+
+    `.ply` and `.glb` go through the binary writers above, anything else
+    through trimesh. Returns the size of the written file in bytes.
+    """
+    if isinstance(mesh, trimesh.Trimesh):
+        colors = mesh.visual.vertex_colors if mesh.visual.kind == "vertex" else None
+        arrays = {"vertices": mesh.vertices, "faces": mesh.faces, "vertex_colors": colors}
+    else:
+        arrays = mesh
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".ply":
+        write_ply(path, arrays["vertices"], arrays["faces"], arrays.get("vertex_colors"))
+    elif ext == ".glb":
+        write_glb(
+            path,
+            arrays["vertices"],
+            arrays["faces"],
+            arrays.get("vertex_colors"),
+            quantize=quantize,
+        )
+    else:
+        if not isinstance(mesh, trimesh.Trimesh):
+            mesh = trimesh.Trimesh(
+                vertices=arrays["vertices"],
+                faces=arrays["faces"],
+                vertex_colors=arrays.get("vertex_colors"),
+                process=False,
+            )
+        mesh.export(path)
+    return os.path.getsize(path)
@@ -3,6 +3,7 @@ from typing import Callable, Optional, Tuple
 import numpy as np
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 from torchmcubes import marching_cubes
 
 
@@ -37,16 +38,145 @@ class MarchingCubeHelper(IsosurfaceHelper):
             self._grid_vertices = verts
         return self._grid_vertices
 
-    def forward(
+    def coarse_to_fine_level(
         self,
-        level: torch.FloatTensor,
+        query_level: Callable[[torch.FloatTensor], torch.FloatTensor],
+        coarse_step: int = 8,
+        device: Optional[torch.device] = None,
+    ) -> torch.FloatTensor:
+        """Level values on the full grid, querying only cells near the iso-surface.
+
+        `query_level` maps (N, 3) points in `points_range` to (N,) level values
+        whose zero crossing is the surface. The grid is first evaluated every
+        `coarse_step` vertices; coarse cells whose corner values straddle zero,
+        dilated by one cell, are then evaluated at full resolution, and every
+        other vertex takes the value of its nearest coarse vertex (which has the
+        same sign). Marching cubes on the result gives the dense mesh as long as
+        surface features are not thinner than a coarse cell.
+        """
+        res = self.resolution
+        axis = torch.linspace(*self.points_range, res, device=device)
+        fine_idx = torch.arange(res, device=device)
+        coarse_idx = torch.arange(0, res, coarse_step, device=device)
+        if coarse_idx[-1] != res - 1:
+            coarse_idx = torch.cat([coarse_idx, coarse_idx.new_tensor([res - 1])])
+        n_coarse = coarse_idx.shape[0]
+
+        coarse_axis = axis[coarse_idx]
+        coarse_points = torch.stack(
+            torch.meshgrid(coarse_axis, coarse_axis, coarse_axis, indexing="ij"), dim=-1
+        )
+        coarse = query_level(coarse_points.view(-1, 3)).view(n_coarse, n_coarse, n_coarse)
+
+        # coarse cells whose corners straddle the iso-level, dilated by one cell
+        cmax = F.max_pool3d(coarse[None, None], kernel_size=2, stride=1)
+        cmin = -F.max_pool3d(-coarse[None, None], kernel_size=2, stride=1)
+        active = ((cmin <= 0) & (cmax >= 0)).float()
+        active = F.max_pool3d(active, kernel_size=3, stride=1, padding=1)[0, 0] > 0
+
+        # coarse cell containing each fine vertex, and the nearest coarse vertex
+        cell = (torch.searchsorted(coarse_idx, fine_idx, right=True) - 1).clamp(
+            0, n_coarse - 2
+        )
+        nearest = torch.where(
+            fine_idx - coarse_idx[cell] <= coarse_idx[cell + 1] - fine_idx, cell, cell + 1
+        )
+        level = coarse[nearest[:, None, None], nearest[None, :, None], nearest[None, None, :]]
+
+        refine = active[cell[:, None, None], cell[None, :, None], cell[None, None, :]]
+        refine_idx = refine.nonzero()
+        if refine_idx.shape[0] > 0:
+            level[refine] = query_level(axis[refine_idx]).to(level.dtype)
+        return level.view(-1)
+
+    def streaming_marching_cubes(
+        self,
+        query_level: Callable[[torch.FloatTensor], torch.FloatTensor],
+        max_slab_bytes: int = 256 * 1024**2,
+        device: Optional[torch.device] = None,
     ) -> Tuple[torch.FloatTensor, torch.LongTensor]:
-        level = -level.view(self.resolution, self.resolution, self.resolution)
+        """Marching cubes over the grid in slabs along the first axis.
+
+        Grid coordinates are generated per slab and `query_level` (the same
+        convention as in `coarse_to_fine_level`) is evaluated slab by slab, so
+        neither the full grid nor the full level volume is ever held. Slab
+        thickness is chosen so that one slab stays under `max_slab_bytes`
+        (about 32 bytes per grid vertex, at least two layers). Adjacent slabs
+        share one layer; the vertices on it are merged so the result has no
+        duplicated vertices. Returns vertices in `points_range` and faces.
+        """
+        res = self.resolution
+        axis = torch.linspace(*self.points_range, res, device=device)
+        slab_size = int(min(res, max(2, max_slab_bytes // (32 * res * res))))
+
+        v_pos_all, t_pos_idx_all = [], []
+        n_verts = 0
+        # keys and global ids of the vertices on the last layer of the previous slab
+        prev_keys = torch.zeros(0, 2, dtype=torch.long, device=device)
+        prev_ids = torch.zeros(0, dtype=torch.long, device=device)
+        x0 = 0
+        while x0 < res - 1:
+            x1 = min(x0 + slab_size - 1, res - 1)
+            slab_points = torch.stack(
+                torch.meshgrid(axis[x0 : x1 + 1], axis, axis, indexing="ij"), dim=-1
+            )
+            level = query_level(slab_points.view(-1, 3)).view(x1 - x0 + 1, res, res)
+            del slab_points
+            v_pos, t_pos_idx = self._marching_cubes(level)
+            v_pos, t_pos_idx = v_pos.to(device), t_pos_idx.to(device).long()
+
+            # vertices on the shared layer, keyed by their in-layer position
+            keys = torch.round(v_pos[:, 1:] * 65536.0).long()
+            first = v_pos[:, 0] == 0
+            last = v_pos[:, 0] == x1 - x0
+
+            local_to_global = torch.full(
+                (v_pos.shape[0],), -1, dtype=torch.long, device=device
+            )
+            if first.any() and prev_ids.shape[0] > 0:
+                n_prev = prev_keys.shape[0]
+                _, inverse = torch.unique(
+                    torch.cat([prev_keys, keys[first]]), dim=0, return_inverse=True
+                )
+                table = torch.full(
+                    (int(inverse.max()) + 1,), -1, dtype=torch.long, device=device
+                )
+                table[inverse[:n_prev]] = prev_ids
+                local_to_global[first] = table[inverse[n_prev:]]
+            new = local_to_global < 0
+            local_to_global[new] = n_verts + torch.arange(
+                int(new.sum()), dtype=torch.long, device=device
+            )
+            n_verts += int(new.sum())
+
+            v_pos[:, 0] += x0
+            v_pos_all.append(v_pos[new])
+            t_pos_idx_all.append(local_to_global[t_pos_idx])
+            prev_keys, prev_ids = keys[last], local_to_global[last]
+            x0 = x1
+
+        v_pos = torch.cat(v_pos_all, dim=0) / (res - 1.0)
+        t_pos_idx = torch.cat(t_pos_idx_all, dim=0)
+        return v_pos, t_pos_idx
+
+    def _marching_cubes(
+        self, level: torch.FloatTensor
+    ) -> Tuple[torch.FloatTensor, torch.LongTensor]:
+        # iso-surface at 0 of a level volume; vertices in grid units, axis order
+        # matching the volume's dimensions
         try:
             v_pos, t_pos_idx = self.mc_func(level.detach(), 0.0)
         except AttributeError:
             print("torchmcubes was not compiled with CUDA support, use CPU version instead.")
             v_pos, t_pos_idx = self.mc_func(level.detach().cpu(), 0.0)
         v_pos = v_pos[..., [2, 1, 0]]
+        return v_pos, t_pos_idx
+
+    def forward(
+        self,
+        level: torch.FloatTensor,
+    ) -> Tuple[torch.FloatTensor, torch.LongTensor]:
+        level = -level.view(self.resolution, self.resolution, self.resolution)
+        v_pos, t_pos_idx = self._marching_cubes(level)
         v_pos = v_pos / (self.resolution - 1.0)
         return v_pos.to(level.device), t_pos_idx.to(level.device)
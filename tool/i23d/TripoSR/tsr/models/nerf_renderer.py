@@ -1,9 +1,9 @@
 from dataclasses import dataclass
-from typing import Dict
+from typing import Dict, Optional, Tuple
 
 import torch
 import torch.nn.functional as F
-from einops import rearrange, reduce
+from einops import rearrange, reduce, repeat
 
 from ..utils import (
     BaseModule,
@@ -26,11 +26,27 @@ class TriplaneNeRFRenderer(BaseModule):
         num_samples_per_ray: int = 128
         randomized: bool = False
 
+        # "dense" queries every sample, "occgrid" skips samples in cells that a
+        # coarse density query found empty
+        estimator: str = "dense"
+        occgrid_resolution: int = 64
+        occgrid_threshold: float = 0.01
+
+        # > 0 enables marching: samples are processed in depth segments and rays
+        # whose transmittance drops below the threshold stop being queried
+        termination_threshold: float = 0.0
+        march_segment_size: int = 16
+
     cfg: Config
 
     def configure(self) -> None:
         assert self.cfg.feature_reduction in ["concat", "mean"]
         self.chunk_size = 0
+        self.isosurface_chunk_size = None
+        self.set_estimator(self.cfg.estimator)
+        self.set_early_termination(
+            self.cfg.termination_threshold, self.cfg.march_segment_size
+        )
 
     def set_chunk_size(self, chunk_size: int):
         assert (
@@ -38,15 +54,81 @@ class TriplaneNeRFRenderer(BaseModule):
         ), "chunk_size must be a non-negative integer (0 for no chunking)."
         self.chunk_size = chunk_size
 
+    def set_isosurface_chunk_size(self, chunk_size: Optional[int]):
+        # chunk size of the density queries made for mesh extraction, which
+        # decode far more points at once than rendering; None reuses chunk_size
+        assert (
+            chunk_size is None or chunk_size >= 0
+        ), "chunk_size must be None or a non-negative integer (0 for no chunking)."
+        self.isosurface_chunk_size = chunk_size
+
+    def set_estimator(self, estimator: str):
+        assert estimator in [
+            "dense",
+            "occgrid",
+        ], "estimator must be one of 'dense' or 'occgrid'."
+        self.estimator = estimator
+
+    def set_early_termination(
+        self, termination_threshold: float, march_segment_size: Optional[int] = None
+    ):
+        assert (
+            termination_threshold >= 0
+        ), "termination_threshold must be non-negative (0 to disable marching)."
+        self.termination_threshold = termination_threshold
+        if march_segment_size is not None:
+            assert march_segment_size > 0, "march_segment_size must be positive."
+            self.march_segment_size = march_segment_size
+
+    @torch.no_grad()
+    def build_occupancy_grid(
+        self,
+        decoder: torch.nn.Module,
+        triplane: torch.Tensor,
+    ) -> torch.BoolTensor:
+        """Coarse (R, R, R) occupancy of the bounding box for one scene code.
+
+        Density is queried at the cell corners; a cell is occupied if any corner
+        exceeds `occgrid_threshold`, and the result is dilated by one cell so that
+        thin structures between corners are not culled.
+        """
+        res = self.cfg.occgrid_resolution
+        coords = torch.linspace(
+            -self.cfg.radius, self.cfg.radius, res + 1, device=triplane.device
+        )
+        corners = torch.stack(torch.meshgrid(coords, coords, coords, indexing="ij"), dim=-1)
+        density = self.query_triplane(decoder, corners, triplane)["density_act"]
+        density = density[..., 0][None, None]  # (1, 1, R+1, R+1, R+1)
+        density = F.max_pool3d(density, kernel_size=2, stride=1)
+        occupied = (density > self.cfg.occgrid_threshold).float()
+        occupied = F.max_pool3d(occupied, kernel_size=3, stride=1, padding=1)
+        return occupied[0, 0] > 0
+
+    def occupancy_mask(
+        self, positions: torch.Tensor, occupancy_grid: torch.BoolTensor
+    ) -> torch.BoolTensor:
+        res = occupancy_grid.shape[-1]
+        idx = scale_tensor(positions, (-self.cfg.radius, self.cfg.radius), (0, res))
+        idx = idx.long().clamp(0, res - 1)
+        return occupancy_grid[idx[..., 0], idx[..., 1], idx[..., 2]]
+
     def query_triplane(
         self,
         decoder: torch.nn.Module,
         positions: torch.Tensor,
         triplane: torch.Tensor,
+        chunk_size: Optional[int] = None,
     ) -> Dict[str, torch.Tensor]:
+        chunk_size = self.chunk_size if chunk_size is None else chunk_size
         input_shape = positions.shape[:-1]
         positions = positions.view(-1, 3)
 
+        # a batch of triplanes (B, Np, Cp, Hp, Wp) is queried at shared positions
+        # and yields outputs with a leading B dimension
+        batched = triplane.ndim == 5
+        triplanes = triplane if batched else triplane[None]
+        n_triplanes = triplanes.shape[0]
+
         # positions in (-radius, radius)
         # normalized to (-1, 1) for grid sample
         positions = scale_tensor(
@@ -59,23 +141,28 @@ class TriplaneNeRFRenderer(BaseModule):
                 dim=-3,
             )
             out: torch.Tensor = F.grid_sample(
-                rearrange(triplane, "Np Cp Hp Wp -> Np Cp Hp Wp", Np=3),
-                rearrange(indices2D, "Np N Nd -> Np () N Nd", Np=3),
+                rearrange(triplanes, "B Np Cp Hp Wp -> (B Np) Cp Hp Wp", Np=3),
+                repeat(indices2D, "Np N Nd -> (B Np) () N Nd", B=n_triplanes, Np=3),
                 align_corners=False,
                 mode="bilinear",
             )
             if self.cfg.feature_reduction == "concat":
-                out = rearrange(out, "Np Cp () N -> N (Np Cp)", Np=3)
+                out = rearrange(out, "(B Np) Cp () N -> N B (Np Cp)", Np=3)
             elif self.cfg.feature_reduction == "mean":
-                out = reduce(out, "Np Cp () N -> N Cp", Np=3, reduction="mean")
+                out = reduce(
+                    out, "(B Np) Cp () N -> N B Cp", Np=3, reduction="mean"
+                )
             else:
                 raise NotImplementedError
 
             net_out: Dict[str, torch.Tensor] = decoder(out)
             return net_out
 
-        if self.chunk_size > 0:
-            net_out = chunk_batch(_query_chunk, self.chunk_size, positions)
+        if chunk_size > 0:
+            # keep the number of decoded points per chunk independent of B
+            net_out = chunk_batch(
+                _query_chunk, max(1, chunk_size // n_triplanes), positions
+            )
         else:
             net_out = _query_chunk(positions)
 
@@ -86,16 +173,143 @@ class TriplaneNeRFRenderer(BaseModule):
             net_out["features"]
         )
 
-        net_out = {k: v.view(*input_shape, -1) for k, v in net_out.items()}
+        # explicit channel counts, as -1 cannot be inferred for zero positions
+        if batched:
+            net_out = {
+                k: v.transpose(0, 1).reshape(n_triplanes, *input_shape, v.shape[-1])
+                for k, v in net_out.items()
+            }
+        else:
+            net_out = {
+                k: v[:, 0].reshape(*input_shape, v.shape[-1]) for k, v in net_out.items()
+            }
 
         return net_out
 
+    def _query_samples(
+        self,
+        decoder: torch.nn.Module,
+        triplane: torch.Tensor,
+        xyz: torch.Tensor,
+        occupancy_grid: Optional[torch.BoolTensor] = None,
+    ) -> Dict[str, torch.Tensor]:
+        if occupancy_grid is None:
+            return self.query_triplane(
+                decoder=decoder,
+                positions=xyz,
+                triplane=triplane,
+            )
+
+        # only samples in occupied cells reach the decoder; the rest keep zero
+        # density and therefore zero weight in the compositing
+        sample_mask = self.occupancy_mask(xyz, occupancy_grid)  # (N_rays, N_samples)
+        if not sample_mask.any():
+            batch_shape = triplane.shape[:-4]
+            return {
+                k: torch.zeros(
+                    *batch_shape, *sample_mask.shape, n_channels,
+                    dtype=triplane.dtype, device=triplane.device,
+                )
+                for k, n_channels in [("density_act", 1), ("color", 3)]
+            }
+        mlp_out_ = self.query_triplane(
+            decoder=decoder,
+            positions=xyz[sample_mask],
+            triplane=triplane,
+        )
+        mlp_out = {}
+        for k in ["density_act", "color"]:
+            v = mlp_out_[k]
+            mlp_out[k] = torch.zeros(
+                *v.shape[:-2], *sample_mask.shape, v.shape[-1],
+                dtype=v.dtype, device=v.device,
+            )
+            mlp_out[k][..., sample_mask, :] = v
+        return mlp_out
+
+    def _march(
+        self,
+        decoder: torch.nn.Module,
+        triplane: torch.Tensor,
+        rays_o: torch.Tensor,
+        rays_d: torch.Tensor,
+        z_vals: torch.Tensor,
+        t_vals: torch.Tensor,
+        occupancy_grid: Optional[torch.BoolTensor] = None,
+    ):
+        """Composite valid rays segment by segment with early ray termination.
+
+        Samples are processed `march_segment_size` at a time; after each segment,
+        rays whose transmittance fell below `termination_threshold` (in every
+        scene, for a batch of triplanes) are dropped and only the remaining
+        active rays are queried. Weights match the dense compositing, truncated
+        by at most the threshold per ray.
+        """
+        eps = 1e-10
+        deltas = t_vals[1:] - t_vals[:-1]
+        n_rays, n_samples = z_vals.shape
+        batch_shape = triplane.shape[:-4]
+
+        comp_rgb_ = torch.zeros(
+            *batch_shape, n_rays, 3, dtype=rays_o.dtype, device=rays_o.device
+        )
+        opacity_ = torch.zeros(
+            *batch_shape, n_rays, dtype=rays_o.dtype, device=rays_o.device
+        )
+        # transmittance accumulated before the current segment
+        trans = torch.ones_like(opacity_)
+        active = torch.arange(n_rays, device=rays_o.device)
+
+        for s0 in range(0, n_samples, self.march_segment_size):
+            if active.numel() == 0:
+                break
+            s1 = min(s0 + self.march_segment_size, n_samples)
+            xyz = (
+                rays_o[active][:, None, :]
+                + z_vals[active, s0:s1, None] * rays_d[active][:, None, :]
+            )  # (N_active, N_segment, 3)
+            if (
+                occupancy_grid is not None
+                and not self.occupancy_mask(xyz, occupancy_grid).any()
+            ):
+                # empty space (e.g. right after the bbox entry): no weight, and
+                # the transmittance carries over unchanged
+                continue
+            mlp_out = self._query_samples(decoder, triplane, xyz, occupancy_grid)
+
+            alpha = 1 - torch.exp(
+                -deltas[s0:s1] * mlp_out["density_act"][..., 0]
+            )  # ([B,] N_active, N_segment)
+            accum_prod = torch.cat(
+                [
+                    torch.ones_like(alpha[..., :1]),
+                    torch.cumprod(1 - alpha[..., :-1] + eps, dim=-1),
+                ],
+                dim=-1,
+            ) * trans[..., active, None]
+            weights = alpha * accum_prod
+            comp_rgb_[..., active, :] += (weights[..., None] * mlp_out["color"]).sum(
+                dim=-2
+            )
+            opacity_[..., active] += weights.sum(dim=-1)
+
+            trans_ = accum_prod[..., -1] * (1 - alpha[..., -1] + eps)
+            trans[..., active] = trans_
+            keep = trans_ > self.termination_threshold
+            if keep.ndim > 1:
+                keep = keep.any(dim=0)
+            active = active[keep]
+
+        return comp_rgb_, opacity_
+
     def _forward(
         self,
         decoder: torch.nn.Module,
         triplane: torch.Tensor,
         rays_o: torch.Tensor,
         rays_d: torch.Tensor,
+        occupancy_grid: Optional[torch.BoolTensor] = None,
+        ray_bbox: Optional[Tuple[torch.Tensor, torch.Tensor, torch.BoolTensor]] = None,
         **kwargs,
     ):
         rays_shape = rays_o.shape[:-1]
@@ -103,7 +317,15 @@ class TriplaneNeRFRenderer(BaseModule):
         rays_d = rays_d.view(-1, 3)
         n_rays = rays_o.shape[0]
 
-        t_near, t_far, rays_valid = rays_intersect_bbox(rays_o, rays_d, self.cfg.radius)
+        if ray_bbox is None:
+            t_near, t_far, rays_valid = rays_intersect_bbox(
+                rays_o, rays_d, self.cfg.radius
+            )
+        else:
+            # precomputed rays_intersect_bbox(rays_o, rays_d, radius) of a known rig
+            t_near, t_far, rays_valid = ray_bbox
+            t_near, t_far = t_near.reshape(-1, 1), t_far.reshape(-1, 1)
+            rays_valid = rays_valid.reshape(-1)
         t_near, t_far = t_near[rays_valid], t_far[rays_valid]
 
         t_vals = torch.linspace(
@@ -112,42 +334,54 @@ class TriplaneNeRFRenderer(BaseModule):
         t_mid = (t_vals[:-1] + t_vals[1:]) / 2.0
         z_vals = t_near * (1 - t_mid[None]) + t_far * t_mid[None]  # (N_rays, N_samples)
 
-        xyz = (
-            rays_o[:, None, :] + z_vals[..., None] * rays_d[..., None, :]
-        )  # (N_rays, N_sample, 3)
+        if self.termination_threshold > 0:
+            comp_rgb_, opacity_ = self._march(
+                decoder,
+                triplane,
+                rays_o[rays_valid],
+                rays_d[rays_valid],
+                z_vals,
+                t_vals,
+                occupancy_grid,
+            )
+        else:
+            xyz = (
+                rays_o[rays_valid][:, None, :]
+                + z_vals[..., None] * rays_d[rays_valid][..., None, :]
+            )  # (N_rays, N_sample, 3)
 
-        mlp_out = self.query_triplane(
-            decoder=decoder,
-            positions=xyz,
-            triplane=triplane,
-        )
+            mlp_out = self._query_samples(decoder, triplane, xyz, occupancy_grid)
 
-        eps = 1e-10
-        # deltas = z_vals[:, 1:] - z_vals[:, :-1] # (N_rays, N_samples)
-        deltas = t_vals[1:] - t_vals[:-1]  # (N_rays, N_samples)
-        alpha = 1 - torch.exp(
-            -deltas * mlp_out["density_act"][..., 0]
-        )  # (N_rays, N_samples)
-        accum_prod = torch.cat(
-            [
-                torch.ones_like(alpha[:, :1]),
-                torch.cumprod(1 - alpha[:, :-1] + eps, dim=-1),
-            ],
-            dim=-1,
-        )
-        weights = alpha * accum_prod  # (N_rays, N_samples)
-        comp_rgb_ = (weights[..., None] * mlp_out["color"]).sum(dim=-2)  # (N_rays, 3)
-        opacity_ = weights.sum(dim=-1)  # (N_rays)
+            eps = 1e-10
+            # deltas = z_vals[:, 1:] - z_vals[:, :-1] # (N_rays, N_samples)
+            deltas = t_vals[1:] - t_vals[:-1]  # (N_rays, N_samples)
+            alpha = 1 - torch.exp(
+                -deltas * mlp_out["density_act"][..., 0]
+            )  # ([B,] N_rays, N_samples)
+            accum_prod = torch.cat(
+                [
+                    torch.ones_like(alpha[..., :1]),
+                    torch.cumprod(1 - alpha[..., :-1] + eps, dim=-1),
+                ],
+                dim=-1,
+            )
+            weights = alpha * accum_prod  # ([B,] N_rays, N_samples)
+            comp_rgb_ = (weights[..., None] * mlp_out["color"]).sum(dim=-2)  # ([B,] N_rays, 3)
+            opacity_ = weights.sum(dim=-1)  # ([B,] N_rays)
 
+        # empty for a single triplane, (B,) for a batch of triplanes
+        batch_shape = triplane.shape[:-4]
         comp_rgb = torch.zeros(
-            n_rays, 3, dtype=comp_rgb_.dtype, device=comp_rgb_.device
+            *batch_shape, n_rays, 3, dtype=comp_rgb_.dtype, device=comp_rgb_.device
+        )
+        opacity = torch.zeros(
+            *batch_shape, n_rays, dtype=opacity_.dtype, device=opacity_.device
         )
-        opacity = torch.zeros(n_rays, dtype=opacity_.dtype, device=opacity_.device)
-        comp_rgb[rays_valid] = comp_rgb_
-        opacity[rays_valid] = opacity_
+        comp_rgb[..., rays_valid, :] = comp_rgb_
+        opacity[..., rays_valid] = opacity_
 
         comp_rgb += 1 - opacity[..., None]
-        comp_rgb = comp_rgb.view(*rays_shape, 3)
+        comp_rgb = comp_rgb.view(*batch_shape, *rays_shape, 3)
 
         return comp_rgb
 
@@ -157,13 +391,35 @@ class TriplaneNeRFRenderer(BaseModule):
         triplane: torch.Tensor,
         rays_o: torch.Tensor,
         rays_d: torch.Tensor,
+        occupancy_grid: Optional[torch.BoolTensor] = None,
+        ray_bbox: Optional[Tuple[torch.Tensor, torch.Tensor, torch.BoolTensor]] = None,
     ) -> Dict[str, torch.Tensor]:
         if triplane.ndim == 4:
-            comp_rgb = self._forward(decoder, triplane, rays_o, rays_d)
+            comp_rgb = self._forward(
+                decoder,
+                triplane,
+                rays_o,
+                rays_d,
+                occupancy_grid=occupancy_grid,
+                ray_bbox=ray_bbox,
+            )
         else:
             comp_rgb = torch.stack(
                 [
-                    self._forward(decoder, triplane[i], rays_o[i], rays_d[i])
+                    self._forward(
+                        decoder,
+                        triplane[i],
+                        rays_o[i],
+                        rays_d[i],
+                        occupancy_grid=(
+                            occupancy_grid[i] if occupancy_grid is not None else None
+                        ),
+                        ray_bbox=(
+                            tuple(v[i] for v in ray_bbox)
+                            if ray_bbox is not None
+                            else None
+                        ),
+                    )
                     for i in range(triplane.shape[0])
                 ],
                 dim=0,
@@ -171,6 +427,49 @@ class TriplaneNeRFRenderer(BaseModule):
 
         return comp_rgb
 
+    def render_batch(
+        self,
+        decoder: torch.nn.Module,
+        triplanes: torch.Tensor,
+        rays_o: torch.Tensor,
+        rays_d: torch.Tensor,
+        ray_chunk_size: int = 0,
+        occupancy_grid: Optional[torch.BoolTensor] = None,
+        ray_bbox: Optional[Tuple[torch.Tensor, torch.Tensor, torch.BoolTensor]] = None,
+    ) -> torch.Tensor:
+        """Render every triplane in (B, Np, Cp, Hp, Wp) from the same rays.
+
+        All rays (e.g. of several views) and all triplanes go through one query
+        stream, processed `ray_chunk_size` rays at a time (0 for no chunking) to
+        bound the memory of the per-sample outputs; returns
+        (B, *rays_o.shape[:-1], 3). With per-scene occupancy grids (B, R, R, R),
+        a sample is skipped only if it is empty in every scene.
+        """
+        assert triplanes.ndim == 5
+        if occupancy_grid is not None and occupancy_grid.ndim == 4:
+            occupancy_grid = occupancy_grid.any(dim=0)
+        rays_shape = rays_o.shape[:-1]
+        if ray_bbox is None:
+            ray_bbox = rays_intersect_bbox(rays_o, rays_d, self.cfg.radius)
+        t_near, t_far, rays_valid = ray_bbox
+        comp_rgb = chunk_batch(
+            lambda rays_o_, rays_d_, t_near_, t_far_, rays_valid_: self._forward(
+                decoder,
+                triplanes,
+                rays_o_,
+                rays_d_,
+                occupancy_grid=occupancy_grid,
+                ray_bbox=(t_near_, t_far_, rays_valid_),
+            ).transpose(0, 1),
+            ray_chunk_size,
+            rays_o.reshape(-1, 3),
+            rays_d.reshape(-1, 3),
+            t_near.reshape(-1, 1),
+            t_far.reshape(-1, 1),
+            rays_valid.reshape(-1),
+        )  # (N_rays, B, 3)
+        return comp_rgb.transpose(0, 1).reshape(triplanes.shape[0], *rays_shape, 3)
+
     def train(self, mode=True):
         self.randomized = mode and self.cfg.randomized
         return super().train(mode=mode)
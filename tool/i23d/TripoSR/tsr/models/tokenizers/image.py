@@ -1,4 +1,6 @@
+import os
 from dataclasses import dataclass
+from typing import Optional
 
 import torch
 import torch.nn as nn
@@ -13,18 +15,30 @@ class DINOSingleImageTokenizer(BaseModule):
     @dataclass
     class Config(BaseModule.Config):
         pretrained_model_name_or_path: str = "facebook/dino-vitb16"
+        # explicit ViT config.json; takes precedence over the lookup below
+        config_path: Optional[str] = None
         enable_gradient_checkpointing: bool = False
 
     cfg: Config
 
+    # ViT configs shipped with the package so that construction needs no hub access
+    BUNDLED_CONFIGS = {"facebook/dino-vitb16": "dino-vitb16.json"}
+
+    def resolve_config_path(self) -> str:
+        name = self.cfg.pretrained_model_name_or_path
+        if self.cfg.config_path is not None:
+            return self.cfg.config_path
+        if os.path.isdir(name):
+            return os.path.join(name, "config.json")
+        if name in self.BUNDLED_CONFIGS:
+            return os.path.join(
+                os.path.dirname(__file__), "configs", self.BUNDLED_CONFIGS[name]
+            )
+        return hf_hub_download(repo_id=name, filename="config.json")
+
     def configure(self) -> None:
         self.model: ViTModel = ViTModel(
-            ViTModel.config_class.from_pretrained(
-                hf_hub_download(
-                    repo_id=self.cfg.pretrained_model_name_or_path,
-                    filename="config.json",
-                )
-            )
+            ViTModel.config_class.from_pretrained(self.resolve_config_path())
         )
 
         if self.cfg.enable_gradient_checkpointing:
@@ -18,13 +18,13 @@ class Triplane1DTokenizer(BaseModule):
 
     def configure(self) -> None:
         self.embeddings = nn.Parameter(
-            torch.randn(
+            torch.empty(
                 (3, self.cfg.num_channels, self.cfg.plane_size, self.cfg.plane_size),
                 dtype=torch.float32,
             )
-            * 1
-            / math.sqrt(self.cfg.num_channels)
         )
+        # initialized in place so that it is skipped for weights on the meta device
+        nn.init.normal_(self.embeddings, std=1 / math.sqrt(self.cfg.num_channels))
 
     def forward(self, batch_size: int) -> torch.Tensor:
         return rearrange(
@@ -446,39 +446,46 @@ class Attention(nn.Module):
 
         return encoder_hidden_states
 
-    @torch.no_grad()
     def fuse_projections(self, fuse=True):
-        is_cross_attention = self.cross_attention_dim != self.query_dim
-        device = self.to_q.weight.data.device
-        dtype = self.to_q.weight.data.dtype
-
-        if not is_cross_attention:
-            # fetch weight matrices.
-            concatenated_weights = torch.cat(
-                [self.to_q.weight.data, self.to_k.weight.data, self.to_v.weight.data]
-            )
-            in_features = concatenated_weights.shape[1]
-            out_features = concatenated_weights.shape[0]
+        """Use concatenated q/k/v (self-attention) or k/v (cross-attention)
+        projection weights, as `FusedSlicedAttnProcessor` does.
 
-            # create a new single projection layer and copy over the weights.
-            self.to_qkv = self.linear_cls(
-                in_features, out_features, bias=False, device=device, dtype=dtype
-            )
-            self.to_qkv.weight.copy_(concatenated_weights)
+        The fused weights are non-persistent buffers, so `state_dict()` is
+        unchanged, and `fused_projection` rebuilds them whenever a source
+        parameter changed (in-place updates, `load_state_dict`, device or
+        dtype moves).
+        """
+        self.fused_projections = fuse
+        self._fused_key = None
+        self.register_buffer("fused_weight", None, persistent=False)
+        self.register_buffer("fused_bias", None, persistent=False)
+        if fuse:
+            self.fused_projection()
 
-        else:
-            concatenated_weights = torch.cat(
-                [self.to_k.weight.data, self.to_v.weight.data]
-            )
-            in_features = concatenated_weights.shape[1]
-            out_features = concatenated_weights.shape[0]
+    def fuses_qkv(self) -> bool:
+        return self.cross_attention_dim == self.query_dim
 
-            self.to_kv = self.linear_cls(
-                in_features, out_features, bias=False, device=device, dtype=dtype
+    @torch.no_grad()
+    def fused_projection(self):
+        layers = (
+            [self.to_q, self.to_k, self.to_v]
+            if self.fuses_qkv()
+            else [self.to_k, self.to_v]
+        )
+        key = tuple(
+            (p.data_ptr(), p._version, p.dtype)
+            for layer in layers
+            for p in layer.parameters()
+        )
+        if key != self._fused_key:
+            self.fused_weight = torch.cat([layer.weight for layer in layers])
+            self.fused_bias = (
+                torch.cat([layer.bias for layer in layers])
+                if layers[0].bias is not None
+                else None
             )
-            self.to_kv.weight.copy_(concatenated_weights)
-
-        self.fused_projections = fuse
+            self._fused_key = key
+        return self.fused_weight, self.fused_bias
 
 
 class AttnProcessor:
@@ -651,3 +658,124 @@ class AttnProcessor2_0:
         hidden_states = hidden_states / attn.rescale_output_factor
 
         return hidden_states
+
+
+class FusedSlicedAttnProcessor:
+    r"""
+    Inference-only processor that uses the fused QKV / KV projections of
+    `Attention.fuse_projections` (rebuilt whenever the projection weights
+    change) and computes attention for `slice_size` query tokens at a time, so
+    the score tensor never exceeds `(batch, heads, slice_size, key_tokens)`. A
+    `slice_size` of None attends over all queries at once.
+    """
+
+    def __init__(self, slice_size: Optional[int] = None):
+        self.slice_size = slice_size
+
+    def __call__(
+        self,
+        attn: Attention,
+        hidden_states: torch.FloatTensor,
+        encoder_hidden_states: Optional[torch.FloatTensor] = None,
+        attention_mask: Optional[torch.FloatTensor] = None,
+    ) -> torch.FloatTensor:
+        if attn.training:
+            raise RuntimeError("FusedSlicedAttnProcessor is for inference only.")
+        assert attn.spatial_norm is None, "spatial_norm is not supported."
+        if not attn.fused_projections:
+            attn.fuse_projections()
+        fused_weight, fused_bias = attn.fused_projection()
+
+        residual = hidden_states
+
+        input_ndim = hidden_states.ndim
+
+        if input_ndim == 4:
+            batch_size, channel, height, width = hidden_states.shape
+            hidden_states = hidden_states.view(
+                batch_size, channel, height * width
+            ).transpose(1, 2)
+
+        batch_size, sequence_length, _ = (
+            hidden_states.shape
+            if encoder_hidden_states is None
+            else encoder_hidden_states.shape
+        )
+        if attention_mask is not None:
+            attention_mask = attn.prepare_attention_mask(
+                attention_mask, sequence_length, batch_size
+            )
+            attention_mask = attention_mask.view(
+                batch_size, attn.heads, -1, attention_mask.shape[-1]
+            )
+
+        if attn.group_norm is not None:
+            hidden_states = attn.group_norm(hidden_states.transpose(1, 2)).transpose(
+                1, 2
+            )
+
+        if encoder_hidden_states is None and attn.fuses_qkv():
+            query, key, value = F.linear(hidden_states, fused_weight, fused_bias).chunk(
+                3, dim=-1
+            )
+        else:
+            query = attn.to_q(hidden_states)
+            if encoder_hidden_states is None:
+                encoder_hidden_states = hidden_states
+            elif attn.norm_cross:
+                encoder_hidden_states = attn.norm_encoder_hidden_states(
+                    encoder_hidden_states
+                )
+            if not attn.fuses_qkv():
+                key, value = F.linear(
+                    encoder_hidden_states, fused_weight, fused_bias
+                ).chunk(2, dim=-1)
+            else:
+                key = attn.to_k(encoder_hidden_states)
+                value = attn.to_v(encoder_hidden_states)
+
+        inner_dim = key.shape[-1]
+        head_dim = inner_dim // attn.heads
+        query = query.reshape(batch_size, -1, attn.heads, head_dim).transpose(1, 2)
+        key = key.reshape(batch_size, -1, attn.heads, head_dim).transpose(1, 2)
+        value = value.reshape(batch_size, -1, attn.heads, head_dim).transpose(1, 2)
+
+        n_queries = query.shape[2]
+        slice_size = self.slice_size or n_queries
+        hidden_states = torch.empty_like(query)
+        for start in range(0, n_queries, slice_size):
+            end = start + slice_size
+            hidden_states[:, :, start:end] = F.scaled_dot_product_attention(
+                query[:, :, start:end],
+                key,
+                value,
+                attn_mask=(
+                    attention_mask[:, :, start:end]
+                    if attention_mask is not None and attention_mask.shape[2] > 1
+                    else attention_mask
+                ),
+                dropout_p=0.0,
+                is_causal=False,
+                scale=attn.scale,
+            )
+
+        hidden_states = hidden_states.transpose(1, 2).reshape(
+            batch_size, -1, attn.heads * head_dim
+        )
+
+        # linear proj
+        hidden_states = attn.to_out[0](hidden_states)
+        # dropout
+        hidden_states = attn.to_out[1](hidden_states)
+
+        if input_ndim == 4:
+            hidden_states = hidden_states.transpose(-1, -2).reshape(
+                batch_size, channel, height, width
+            )
+
+        if attn.residual_connection:
+            hidden_states = hidden_states + residual
+
+        hidden_states = hidden_states / attn.rescale_output_factor
+
+        return hidden_states
@@ -44,6 +44,7 @@ import torch.nn.functional as F
 from torch import nn
 
 from ...utils import BaseModule
+from .attention import AttnProcessor, AttnProcessor2_0, FusedSlicedAttnProcessor
 from .basic_transformer_block import BasicTransformerBlock
 
 
@@ -119,6 +120,130 @@ class Transformer1D(BaseModule):
 
         self.gradient_checkpointing = self.cfg.gradient_checkpointing
 
+        self.prefix_cache_enabled = False
+        self._prefix_cache = None
+
+        self.memory_budget = None
+        self._memory_budget_shape = None
+        self._sliced_processor = None
+
+    def _attention_modules(self):
+        for block in self.transformer_blocks:
+            yield block.attn1
+            if block.attn2 is not None:
+                yield block.attn2
+
+    def set_memory_budget(self, budget_bytes: Optional[int]) -> None:
+        """Bound the attention scores and feed-forward activations of one call.
+
+        Switches every attention layer to `FusedSlicedAttnProcessor` and, on
+        each input shape, picks the largest power-of-two query slice and
+        feed-forward chunk (along the token axis, dividing the token count)
+        whose intermediate tensors fit in `budget_bytes`. Inference only;
+        None restores the default processors and unchunked feed-forward.
+        """
+        self.memory_budget = budget_bytes
+        self._memory_budget_shape = None
+        if budget_bytes is None:
+            self._sliced_processor = None
+            for attn in self._attention_modules():
+                attn.fuse_projections(False)
+                attn.set_processor(
+                    AttnProcessor2_0()
+                    if hasattr(F, "scaled_dot_product_attention") and attn.scale_qk
+                    else AttnProcessor()
+                )
+            for block in self.transformer_blocks:
+                block.set_chunk_feed_forward(None, 0)
+        else:
+            self._sliced_processor = FusedSlicedAttnProcessor()
+            for attn in self._attention_modules():
+                attn.fuse_projections()
+                attn.set_processor(self._sliced_processor)
+
+    def _apply_memory_budget(
+        self, batch: int, seq_len: int, encoder_seq_len: int, dtype: torch.dtype
+    ) -> None:
+        shape = (batch, seq_len, encoder_seq_len, dtype)
+        if self.memory_budget is None or shape == self._memory_budget_shape:
+            return
+        self._memory_budget_shape = shape
+        bytes_per_element = torch.finfo(dtype).bits // 8
+
+        def pow2_floor(x):
+            return 1 << max(0, int(x).bit_length() - 1)
+
+        # scores are (batch, heads, slice, key tokens)
+        key_len = max(seq_len, encoder_seq_len)
+        per_query = batch * self.num_attention_heads * key_len * bytes_per_element
+        slice_size = min(pow2_floor(self.memory_budget // per_query), seq_len)
+        self._sliced_processor.slice_size = slice_size if slice_size < seq_len else None
+
+        # the first feed-forward projection is the widest activation
+        ff_width = self.transformer_blocks[0].ff.net[0].proj.out_features
+        per_token = batch * ff_width * bytes_per_element
+        chunk_size = min(
+            pow2_floor(self.memory_budget // per_token), seq_len & -seq_len
+        )
+        for block in self.transformer_blocks:
+            block.set_chunk_feed_forward(
+                chunk_size if chunk_size < seq_len else None, 1
+            )
+
+    def enable_prefix_cache(self, enabled: bool = True) -> None:
+        """Reuse the input-independent prefix when `hidden_states` is constant.
+
+        When the same `hidden_states` (e.g. learned triplane tokens) is fed for
+        every request, the input GroupNorm, `proj_in` and the first block's
+        self-attention do not depend on the image. With the cache enabled they
+        are computed once for a batch of one and broadcast over the batch of
+        `encoder_hidden_states`; the cache is rebuilt when the input, the
+        prefix weights, their device or dtype change.
+        """
+        self.prefix_cache_enabled = enabled
+        self._prefix_cache = None
+
+    def _prefix_modules(self):
+        return [self.norm, self.proj_in, self.transformer_blocks[0].norm1, self.transformer_blocks[0].attn1]
+
+    def _prefix_key(self, hidden_states: torch.Tensor):
+        return (hidden_states.device, hidden_states.dtype) + tuple(
+            (id(p), p.data_ptr(), p._version)
+            for module in self._prefix_modules()
+            for p in module.parameters()
+        )
+
+    def _prefix(self, hidden_states: torch.Tensor) -> torch.Tensor:
+        batch, _, seq_len = hidden_states.shape
+        hidden_states = self.norm(hidden_states)
+        inner_dim = hidden_states.shape[1]
+        hidden_states = hidden_states.permute(0, 2, 1).reshape(
+            batch, seq_len, inner_dim
+        )
+        hidden_states = self.proj_in(hidden_states)
+        return self.transformer_blocks[0].forward_self_attention(hidden_states)
+
+    def _cached_prefix(self, hidden_states: torch.Tensor) -> torch.Tensor:
+        key = self._prefix_key(hidden_states)
+        if self._prefix_cache is not None:
+            cached_key, cached_input, cached_prefix = self._prefix_cache
+            if cached_key == key and torch.equal(cached_input, hidden_states):
+                return cached_prefix
+        with torch.no_grad():
+            prefix = self._prefix(hidden_states)
+        self._prefix_cache = (key, hidden_states.detach().clone(), prefix)
+        return prefix
+
+    def _use_prefix_cache(self, hidden_states, attention_mask) -> bool:
+        return (
+            self.prefix_cache_enabled
+            and not self.training
+            and not torch.is_grad_enabled()
+            and attention_mask is None
+            and not self.transformer_blocks[0].only_cross_attention
+            and hidden_states.shape[0] == 1
+        )
+
     def forward(
         self,
         hidden_states: torch.Tensor,
@@ -176,19 +301,57 @@ class Transformer1D(BaseModule):
             ) * -10000.0
             encoder_attention_mask = encoder_attention_mask.unsqueeze(1)
 
+        self._apply_memory_budget(
+            encoder_hidden_states.shape[0]
+            if encoder_hidden_states is not None
+            else hidden_states.shape[0],
+            hidden_states.shape[-1],
+            encoder_hidden_states.shape[1]
+            if encoder_hidden_states is not None
+            else 0,
+            hidden_states.dtype,
+        )
+
         # 1. Input
-        batch, _, seq_len = hidden_states.shape
-        residual = hidden_states
+        if self._use_prefix_cache(hidden_states, attention_mask):
+            # a single, constant input row shared by the whole batch
+            batch = (
+                encoder_hidden_states.shape[0]
+                if encoder_hidden_states is not None
+                else 1
+            )
+            _, inner_dim, seq_len = hidden_states.shape
+            residual = hidden_states.expand(batch, -1, -1)
+            hidden_states = self._cached_prefix(hidden_states).expand(batch, -1, -1)
+            hidden_states = self.transformer_blocks[0].forward_after_self_attention(
+                hidden_states,
+                encoder_hidden_states=encoder_hidden_states,
+                encoder_attention_mask=encoder_attention_mask,
+            )
+            blocks = self.transformer_blocks[1:]
+        else:
+            if (
+                encoder_hidden_states is not None
+                and hidden_states.shape[0] == 1
+                and encoder_hidden_states.shape[0] > 1
+            ):
+                # shared input row passed for the prefix cache, but not usable here
+                hidden_states = hidden_states.expand(
+                    encoder_hidden_states.shape[0], -1, -1
+                )
+            batch, _, seq_len = hidden_states.shape
+            residual = hidden_states
 
-        hidden_states = self.norm(hidden_states)
-        inner_dim = hidden_states.shape[1]
-        hidden_states = hidden_states.permute(0, 2, 1).reshape(
-            batch, seq_len, inner_dim
-        )
-        hidden_states = self.proj_in(hidden_states)
+            hidden_states = self.norm(hidden_states)
+            inner_dim = hidden_states.shape[1]
+            hidden_states = hidden_states.permute(0, 2, 1).reshape(
+                batch, seq_len, inner_dim
+            )
+            hidden_states = self.proj_in(hidden_states)
+            blocks = self.transformer_blocks
 
         # 2. Blocks
-        for block in self.transformer_blocks:
+        for block in blocks:
             if self.training and self.gradient_checkpointing:
                 hidden_states = torch.utils.checkpoint.checkpoint(
                     block,
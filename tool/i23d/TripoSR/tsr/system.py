@@ -1,7 +1,11 @@
+import logging
 import math
 import os
+import sys
+import time
+from collections import defaultdict
 from dataclasses import dataclass, field
-from typing import List, Union
+from typing import List, Optional, Union
 
 import numpy as np
 import PIL.Image
@@ -13,16 +17,40 @@ from huggingface_hub import hf_hub_download
 from omegaconf import OmegaConf
 from PIL import Image
 
+from .decimate import decimate_mesh
+from .mesh_io import colors_to_uint8
 from .models.isosurface import MarchingCubeHelper
 from .utils import (
     BaseModule,
     ImagePreprocessor,
+    RayBundleCache,
     find_class,
-    get_spherical_cameras,
+    init_empty_weights,
+    load_weights,
     scale_tensor,
 )
 
 
+def current_rss_mb() -> Optional[float]:
+    # resident set size of this process; /proc is Linux-only, None elsewhere
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024**2
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def peak_rss_mb() -> Optional[float]:
+    # peak RSS over the whole process lifetime; `resource` is Unix-only
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # KiB on Linux, bytes on macOS
+    return peak / 1024**2 if sys.platform == "darwin" else peak / 1024
+
+
 class TSR(BaseModule):
     @dataclass
     class Config(BaseModule.Config):
@@ -50,8 +78,23 @@ class TSR(BaseModule):
 
     @classmethod
     def from_pretrained(
-        cls, pretrained_model_name_or_path: str, config_name: str, weight_name: str
+        cls,
+        pretrained_model_name_or_path: str,
+        config_name: str,
+        weight_name: str,
+        low_cpu_mem_usage: bool = False,
     ):
+        """Build a TSR model and load its weights.
+
+        With `low_cpu_mem_usage`, parameters are created on the meta device
+        (skipping allocation and random initialization) and the checkpoint is
+        memory-mapped and assigned to them directly instead of being copied;
+        `weight_name` may point to a `.safetensors` file (see
+        `convert_weights_to_safetensors`). Load time and the RSS growth of the
+        load are logged.
+        """
+        start_time = time.time()
+        rss_before = current_rss_mb()
         if os.path.isdir(pretrained_model_name_or_path):
             config_path = os.path.join(pretrained_model_name_or_path, config_name)
             weight_path = os.path.join(pretrained_model_name_or_path, weight_name)
@@ -65,9 +108,32 @@ class TSR(BaseModule):
 
         cfg = OmegaConf.load(config_path)
         OmegaConf.resolve(cfg)
-        model = cls(cfg)
-        ckpt = torch.load(weight_path, map_location="cpu")
-        model.load_state_dict(ckpt)
+        if low_cpu_mem_usage:
+            with init_empty_weights():
+                model = cls(cfg)
+            ckpt = load_weights(weight_path, mmap=True)
+            model.load_state_dict(ckpt, assign=True)
+        else:
+            model = cls(cfg)
+            ckpt = load_weights(weight_path)
+            model.load_state_dict(ckpt)
+
+        # files identifying the loaded weights; hashed only by callers that need
+        # a fingerprint, e.g. for keying cached scene codes
+        model.weight_files = (config_path, weight_path)
+
+        memory = ""
+        rss_after = current_rss_mb()
+        if rss_before is not None and rss_after is not None:
+            memory += f", RSS +{rss_after - rss_before:.0f}MB"
+        peak_rss = peak_rss_mb()
+        if peak_rss is not None:
+            # not per load: includes everything the process did before
+            memory += f", process peak RSS {peak_rss:.0f}MB"
+        logging.info(
+            f"Loaded TSR from {weight_path} in {(time.time() - start_time) * 1000:.2f}ms "
+            f"(low_cpu_mem_usage={low_cpu_mem_usage}{memory})."
+        )
         return model
 
     def configure(self):
@@ -83,6 +149,7 @@ class TSR(BaseModule):
         self.renderer = find_class(self.cfg.renderer_cls)(self.cfg.renderer)
         self.image_processor = ImagePreprocessor()
         self.isosurface_helper = None
+        self.ray_bundle_cache = RayBundleCache()
 
     def forward(
         self,
@@ -109,7 +176,11 @@ class TSR(BaseModule):
             input_image_tokens, "B Nv C Nt -> B (Nv Nt) C", Nv=1
         )
 
-        tokens: torch.Tensor = self.tokenizer(batch_size)
+        # with the backbone prefix cache the constant tokens are passed once and
+        # broadcast over the batch inside the backbone
+        tokens: torch.Tensor = self.tokenizer(
+            1 if self.backbone.prefix_cache_enabled else batch_size
+        )
 
         tokens = self.backbone(
             tokens,
@@ -129,11 +200,21 @@ class TSR(BaseModule):
         height: int = 256,
         width: int = 256,
         return_type: str = "pil",
+        vectorized: bool = False,
     ):
-        rays_o, rays_d = get_spherical_cameras(
-            n_views, elevation_deg, camera_distance, fovy_deg, height, width
+        device = scene_codes[0].device
+        rays = self.ray_bundle_cache.get(
+            n_views,
+            elevation_deg,
+            camera_distance,
+            fovy_deg,
+            height,
+            width,
+            device,
+            self.renderer.cfg.radius,
         )
-        rays_o, rays_d = rays_o.to(scene_codes.device), rays_d.to(scene_codes.device)
+        rays_o, rays_d = rays["rays_o"], rays["rays_d"]
+        ray_bbox = (rays["t_near"], rays["t_far"], rays["rays_valid"])
 
         def process_output(image: torch.FloatTensor):
             if return_type == "pt":
@@ -147,19 +228,88 @@ class TSR(BaseModule):
             else:
                 raise NotImplementedError
 
+        if vectorized:
+            return self.render_vectorized(
+                scene_codes, rays_o, rays_d, return_type, ray_bbox=ray_bbox
+            )
+
         images = []
         for scene_code in scene_codes:
+            occupancy_grid = self.build_occupancy_grid(scene_code)
             images_ = []
             for i in range(n_views):
                 with torch.no_grad():
                     image = self.renderer(
-                        self.decoder, scene_code, rays_o[i], rays_d[i]
+                        self.decoder,
+                        scene_code,
+                        rays_o[i],
+                        rays_d[i],
+                        occupancy_grid=occupancy_grid,
+                        ray_bbox=tuple(v[i] for v in ray_bbox),
                     )
                 images_.append(process_output(image))
             images.append(images_)
 
         return images
 
+    def render_vectorized(
+        self,
+        scene_codes,
+        rays_o: torch.FloatTensor,
+        rays_d: torch.FloatTensor,
+        return_type: str = "pil",
+        ray_bbox=None,
+    ):
+        """Render all views (Nv, H, W, 3 rays) of all scene codes at once.
+
+        Scene codes of the same triplane shape are stacked and rendered with the
+        rays of every view concatenated into one chunked query stream; images
+        are copied to the host once per group.
+        """
+        if return_type not in ["pt", "np", "pil"]:
+            raise NotImplementedError
+
+        groups = defaultdict(list)
+        for idx, scene_code in enumerate(scene_codes):
+            groups[tuple(scene_code.shape)].append(idx)
+
+        images = [None] * len(scene_codes)
+        for indices in groups.values():
+            triplanes = torch.stack([scene_codes[idx] for idx in indices], dim=0)
+            occupancy_grids = [self.build_occupancy_grid(tp) for tp in triplanes]
+            with torch.no_grad():
+                group_images = self.renderer.render_batch(
+                    self.decoder,
+                    triplanes,
+                    rays_o,
+                    rays_d,
+                    # keep the per-pass sample count at the level of one view per scene
+                    ray_chunk_size=max(1, rays_o.shape[-3] * rays_o.shape[-2] // len(indices)),
+                    occupancy_grid=(
+                        torch.stack(occupancy_grids, dim=0)
+                        if occupancy_grids[0] is not None
+                        else None
+                    ),
+                    ray_bbox=ray_bbox,
+                )  # (B, Nv, H, W, 3)
+            if return_type != "pt":
+                group_images = group_images.detach().cpu().numpy()
+            if return_type == "pil":
+                group_images = (group_images * 255.0).astype(np.uint8)
+            for idx, images_ in zip(indices, group_images):
+                if return_type == "pil":
+                    images[idx] = [Image.fromarray(image) for image in images_]
+                else:
+                    images[idx] = list(images_)
+
+        return images
+
+    def build_occupancy_grid(self, scene_code):
+        # built once per scene code and shared by all of its views
+        if self.renderer.estimator != "occgrid":
+            return None
+        return self.renderer.build_occupancy_grid(self.decoder, scene_code)
+
     def set_marching_cubes_resolution(self, resolution: int):
         if (
             self.isosurface_helper is not None
@@ -168,21 +318,64 @@ class TSR(BaseModule):
             return
         self.isosurface_helper = MarchingCubeHelper(resolution)
 
-    def extract_mesh(self, scene_codes, resolution: int = 256, threshold: float = 25.0):
+    def extract_mesh(
+        self,
+        scene_codes,
+        resolution: int = 256,
+        threshold: float = 25.0,
+        method: str = "dense",
+        coarse_step: int = 8,
+        max_slab_bytes: int = 256 * 1024**2,
+        output: str = "trimesh",
+        target_faces: Optional[int] = None,
+        max_error: Optional[float] = None,
+    ):
+        """Extract one trimesh per scene code with marching cubes.
+
+        With `output="arrays"`, each mesh is instead a dict of float32
+        `vertices`, int32 `faces` and uint8 `vertex_colors`, skipping trimesh's
+        processing; see `tsr.mesh_io.write_mesh` for writing them. Setting
+        `target_faces` or `max_error` decimates each mesh (see
+        `tsr.decimate.decimate`) before it is returned.
+
+        `method="dense"` queries density at every grid vertex; `"hierarchical"`
+        evaluates a grid `coarse_step` times coarser first and refines only cells
+        that cross `threshold` (see `MarchingCubeHelper.coarse_to_fine_level`);
+        `"streaming"` queries and meshes the grid in slabs of at most
+        `max_slab_bytes` (see `MarchingCubeHelper.streaming_marching_cubes`).
+        """
+        assert method in ["dense", "hierarchical", "streaming"]
+        assert output in ["trimesh", "arrays"]
         self.set_marching_cubes_resolution(resolution)
         meshes = []
         for scene_code in scene_codes:
-            with torch.no_grad():
-                density = self.renderer.query_triplane(
-                    self.decoder,
-                    scale_tensor(
-                        self.isosurface_helper.grid_vertices.to(scene_codes.device),
-                        self.isosurface_helper.points_range,
-                        (-self.renderer.cfg.radius, self.renderer.cfg.radius),
-                    ),
-                    scene_code,
-                )["density_act"]
-            v_pos, t_pos_idx = self.isosurface_helper(-(density - threshold))
+
+            def query_level(points):
+                with torch.no_grad():
+                    density = self.renderer.query_triplane(
+                        self.decoder,
+                        scale_tensor(
+                            points.to(scene_code.device),
+                            self.isosurface_helper.points_range,
+                            (-self.renderer.cfg.radius, self.renderer.cfg.radius),
+                        ),
+                        scene_code,
+                        chunk_size=self.renderer.isosurface_chunk_size,
+                    )["density_act"]
+                return density[..., 0] - threshold
+
+            if method == "streaming":
+                v_pos, t_pos_idx = self.isosurface_helper.streaming_marching_cubes(
+                    query_level, max_slab_bytes=max_slab_bytes, device=scene_code.device
+                )
+            else:
+                if method == "hierarchical":
+                    level = self.isosurface_helper.coarse_to_fine_level(
+                        query_level, coarse_step=coarse_step, device=scene_code.device
+                    )
+                else:
+                    level = query_level(self.isosurface_helper.grid_vertices)
+                v_pos, t_pos_idx = self.isosurface_helper(-level)
             v_pos = scale_tensor(
                 v_pos,
                 self.isosurface_helper.points_range,
@@ -193,11 +386,33 @@ class TSR(BaseModule):
                     self.decoder,
                     v_pos,
                     scene_code,
+                    chunk_size=self.renderer.isosurface_chunk_size,
                 )["color"]
-            mesh = trimesh.Trimesh(
-                vertices=v_pos.cpu().numpy(),
-                faces=t_pos_idx.cpu().numpy(),
-                vertex_colors=color.cpu().numpy(),
-            )
+            if output == "arrays":
+                mesh = {
+                    "vertices": v_pos.float().cpu().numpy(),
+                    "faces": t_pos_idx.int().cpu().numpy(),
+                    "vertex_colors": colors_to_uint8(color.float().cpu().numpy()),
+                }
+            elif target_faces is not None or max_error is not None:
+                mesh = {
+                    "vertices": v_pos.cpu().numpy(),
+                    "faces": t_pos_idx.cpu().numpy(),
+                    "vertex_colors": color.cpu().numpy(),
+                }
+            else:
+                mesh = trimesh.Trimesh(
+                    vertices=v_pos.cpu().numpy(),
+                    faces=t_pos_idx.cpu().numpy(),
+                    vertex_colors=color.cpu().numpy(),
+                )
+            if target_faces is not None or max_error is not None:
+                mesh = decimate_mesh(mesh, target_faces=target_faces, max_error=max_error)
+                if output == "trimesh":
+                    mesh = trimesh.Trimesh(
+                        vertices=mesh["vertices"],
+                        faces=mesh["faces"],
+                        vertex_colors=mesh["vertex_colors"],
+                    )
             meshes.append(mesh)
         return meshes
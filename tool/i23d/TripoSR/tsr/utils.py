@@ -1,6 +1,12 @@
 import importlib
+import logging
 import math
-from collections import defaultdict
+import queue
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
 from dataclasses import dataclass
 from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
@@ -43,6 +49,57 @@ def get_intrinsic_from_fov(fov, H, W, bs=-1):
     return torch.from_numpy(intrinsic)
 
 
+@contextmanager
+def init_empty_weights():
+    """Construct modules with their parameters on the meta device.
+
+    Parameters registered inside this context are moved to "meta" as soon as
+    they are registered, so no memory is allocated for them and initializers
+    that run afterwards (e.g. `reset_parameters`, kaiming init) are no-ops.
+    Buffers stay on CPU. The weights must then be supplied with
+    `load_state_dict(..., assign=True)`.
+    """
+    old_register_parameter = nn.Module.register_parameter
+
+    def register_empty_parameter(module, name, param):
+        old_register_parameter(module, name, param)
+        if param is not None:
+            param = module._parameters[name]
+            module._parameters[name] = type(param)(
+                param.to("meta"), requires_grad=param.requires_grad
+            )
+
+    nn.Module.register_parameter = register_empty_parameter
+    try:
+        yield
+    finally:
+        nn.Module.register_parameter = old_register_parameter
+
+
+def load_weights(weight_path: str, mmap: bool = False) -> Dict[str, torch.Tensor]:
+    """Load a state dict from a .safetensors file (memory-mapped) or a torch
+    checkpoint (memory-mapped if `mmap` and the checkpoint format allows it)."""
+    if weight_path.endswith(".safetensors"):
+        from safetensors.torch import load_file
+
+        return load_file(weight_path, device="cpu")
+    if mmap:
+        try:
+            return torch.load(weight_path, map_location="cpu", mmap=True)
+        except (RuntimeError, TypeError):
+            # legacy (non-zipfile) checkpoints or torch < 2.1
+            pass
+    return torch.load(weight_path, map_location="cpu")
+
+
+def convert_weights_to_safetensors(weight_path: str, output_path: str) -> None:
+    """Convert a torch checkpoint (e.g. TripoSR's model.ckpt) to .safetensors."""
+    from safetensors.torch import save_file
+
+    state_dict = torch.load(weight_path, map_location="cpu")
+    save_file({k: v.contiguous() for k, v in state_dict.items()}, output_path)
+
+
 class BaseModule(nn.Module):
     @dataclass
     class Config:
@@ -399,6 +456,65 @@ def get_spherical_cameras(
     return rays_o, rays_d
 
 
+class RayBundleCache:
+    """LRU cache of `get_spherical_cameras` ray bundles, kept on their device.
+
+    Each entry also holds `rays_intersect_bbox` for the renderer radius, so a
+    known camera rig costs no ray setup at all after its first use.
+    """
+
+    def __init__(self, max_entries: int = 8):
+        self.max_entries = max_entries
+        self.entries: OrderedDict = OrderedDict()
+
+    def get(
+        self,
+        n_views: int,
+        elevation_deg: float,
+        camera_distance: float,
+        fovy_deg: float,
+        height: int,
+        width: int,
+        device: Union[str, torch.device],
+        radius: float,
+    ) -> Dict[str, torch.Tensor]:
+        key = (
+            n_views,
+            float(elevation_deg),
+            float(camera_distance),
+            float(fovy_deg),
+            height,
+            width,
+            str(device),
+            float(radius),
+        )
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+        rays_o, rays_d = get_spherical_cameras(
+            n_views, elevation_deg, camera_distance, fovy_deg, height, width
+        )
+        # get_rays returns expanded (non-contiguous) origins, which the ray
+        # setup and the renderer flatten with view()
+        rays_o, rays_d = rays_o.to(device).contiguous(), rays_d.to(device).contiguous()
+        t_near, t_far, rays_valid = rays_intersect_bbox(rays_o, rays_d, radius)
+        bundle = {
+            "rays_o": rays_o,
+            "rays_d": rays_d,
+            "t_near": t_near,
+            "t_far": t_far,
+            "rays_valid": rays_valid,
+        }
+        self.entries[key] = bundle
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return bundle
+
+    def clear(self):
+        self.entries.clear()
+
+
 def remove_background(
     image: PIL.Image.Image,
     rembg_session: Any = None,
@@ -455,6 +571,83 @@ def resize_foreground(
     return new_image
 
 
+def remove_background_and_composite(
+    image: PIL.Image.Image,
+    rembg_session: Any = None,
+    foreground_ratio: float = 0.85,
+) -> PIL.Image.Image:
+    # background removal, foreground resize and composite over 50% gray
+    image = remove_background(image, rembg_session)
+    image = resize_foreground(image, foreground_ratio)
+    image = np.array(image).astype(np.float32) / 255.0
+    image = image[:, :, :3] * image[:, :, 3:4] + (1 - image[:, :, 3:4]) * 0.5
+    return PIL.Image.fromarray((image * 255.0).astype(np.uint8))
+
+
+_worker_rembg_session = None
+
+
+def _init_rembg_worker():
+    global _worker_rembg_session
+    _worker_rembg_session = rembg.new_session()
+
+
+def _remove_background_in_worker(image, foreground_ratio):
+    return remove_background_and_composite(image, _worker_rembg_session, foreground_ratio)
+
+
+class BackgroundRemover:
+    """Runs `remove_background_and_composite` on batches of images concurrently.
+
+    With threads (the default; onnxruntime releases the GIL during inference)
+    a pool of `num_workers` rembg sessions is shared by the workers, each session
+    used by one image at a time. With `use_processes=True` every worker process
+    creates its own session once.
+    """
+
+    def __init__(
+        self,
+        num_workers: int = 1,
+        foreground_ratio: float = 0.85,
+        use_processes: bool = False,
+    ):
+        self.foreground_ratio = foreground_ratio
+        self.use_processes = use_processes
+        if use_processes:
+            self.executor = ProcessPoolExecutor(
+                max_workers=num_workers, initializer=_init_rembg_worker
+            )
+        else:
+            self.sessions = queue.Queue()
+            for _ in range(num_workers):
+                self.sessions.put(rembg.new_session())
+            self.executor = ThreadPoolExecutor(max_workers=num_workers)
+
+    def _process(self, image: PIL.Image.Image) -> PIL.Image.Image:
+        session = self.sessions.get()
+        try:
+            return remove_background_and_composite(
+                image, session, self.foreground_ratio
+            )
+        finally:
+            self.sessions.put(session)
+
+    def __call__(self, images: List[PIL.Image.Image]) -> List[PIL.Image.Image]:
+        if self.use_processes:
+            futures = [
+                self.executor.submit(
+                    _remove_background_in_worker, image, self.foreground_ratio
+                )
+                for image in images
+            ]
+        else:
+            futures = [self.executor.submit(self._process, image) for image in images]
+        return [future.result() for future in futures]
+
+    def close(self):
+        self.executor.shutdown()
+
+
 def save_video(
     frames: List[PIL.Image.Image],
     output_path: str,
@@ -468,6 +661,112 @@ def save_video(
     writer.close()
 
 
+class AsyncWriter:
+    """Writes renders, videos and meshes on a background thread pool.
+
+    Submitted objects are owned by the writer until written, so callers must
+    not modify them afterwards. At most `max_queue_size` writes are pending at
+    once; further submits block until a worker frees a slot. `wait` blocks only
+    on the given output paths; it logs every write error among them and
+    re-raises the first.
+    """
+
+    def __init__(self, num_workers: int = 2, max_queue_size: int = 32):
+        self.executor = ThreadPoolExecutor(max_workers=num_workers)
+        self.slots = threading.BoundedSemaphore(max_queue_size)
+        self.lock = threading.Lock()
+        self.pending: Dict[str, Future] = {}
+        self.n_written = 0
+        self.write_time = 0.0
+        self.max_queue_depth = 0
+
+    def _run(self, fn: Callable, *args, **kwargs):
+        start_time = time.time()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self.lock:
+                self.n_written += 1
+                self.write_time += time.time() - start_time
+            self.slots.release()
+
+    def submit(self, path: str, fn: Callable, *args, **kwargs) -> Future:
+        self.slots.acquire()
+        future = self.executor.submit(self._run, fn, *args, **kwargs)
+        with self.lock:
+            self.pending[path] = future
+            self.max_queue_depth = max(self.max_queue_depth, self.queue_depth())
+        future.add_done_callback(lambda _: self._forget(path, future))
+        return future
+
+    def _forget(self, path: str, future: Future):
+        with self.lock:
+            if self.pending.get(path) is future and future.exception() is None:
+                del self.pending[path]
+
+    def save_image(self, image: PIL.Image.Image, path: str) -> Future:
+        return self.submit(path, image.save, path)
+
+    def save_video(
+        self, frames: List[PIL.Image.Image], path: str, fps: int = 30
+    ) -> Future:
+        return self.submit(path, save_video, frames, path, fps=fps)
+
+    def save_mesh(self, mesh, path: str, quantize: bool = False) -> Future:
+        # trimesh or `extract_mesh(output="arrays")` dict, format from the extension
+        return self.submit(path, self._write_mesh, mesh, path, quantize)
+
+    def _write_mesh(self, mesh, path: str, quantize: bool):
+        from .mesh_io import write_mesh
+
+        start_time = time.time()
+        size = write_mesh(path, mesh, quantize=quantize)
+        logging.info(
+            f"Wrote {path} ({size / 1024**2:.2f}MB) in "
+            f"{(time.time() - start_time) * 1000:.2f}ms."
+        )
+
+    def queue_depth(self) -> int:
+        return sum(not future.done() for future in self.pending.values())
+
+    def wait(self, paths: Optional[List[str]] = None) -> None:
+        with self.lock:
+            if paths is None:
+                futures = list(self.pending.items())
+            else:
+                futures = [(p, self.pending[p]) for p in paths if p in self.pending]
+        # every future is waited for and forgotten, even after a failed write
+        errors = []
+        for path, future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                logging.error(f"Failed to write {path}: {e!r}")
+                errors.append(e)
+            finally:
+                with self.lock:
+                    if self.pending.get(path) is future:
+                        del self.pending[path]
+        if errors:
+            raise errors[0]
+
+    def flush(self) -> None:
+        self.wait()
+
+    def stats(self) -> Dict[str, float]:
+        with self.lock:
+            return {
+                "queue_depth": self.queue_depth(),
+                "max_queue_depth": self.max_queue_depth,
+                "written": self.n_written,
+                "write_time_ms": self.write_time * 1000,
+            }
+
+    def close(self):
+        self.flush()
+        self.executor.shutdown()
+
+
 def to_gradio_3d_orientation(mesh):
     mesh.apply_transform(trimesh.transformations.rotation_matrix(-np.pi/2, [1, 0, 0]))
     mesh.apply_transform(trimesh.transformations.rotation_matrix(np.pi/2, [0, 1, 0]))
@@ -0,0 +1,127 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+def image_hash(image):
+    # content hash of a PIL image (or of a list of them, as the LMM wrappers accept);
+    # text-only questions have no image
+    h = hashlib.sha256()
+    if image is None:
+        return h.hexdigest()
+    for im in image if type(image) == list else [image]:
+        h.update(f'{im.mode}:{im.size};'.encode())
+        h.update(im.tobytes())
+    return h.hexdigest()
+
+
+class lmm_cached():
+    """Persistent cache of LMM answers in front of an `lmm_*` wrapper.
+
+    Answers are stored in a SQLite file keyed by backend, model id, question,
+    image content hash and generation settings. Entries are evicted least
+    recently used first once the stored answers exceed `max_bytes`. Sampled
+    calls (`num_return_sequences > 1` or `do_sample=True`, and any call to a
+    backend in `SAMPLING_BACKENDS` without `temperature=0`) bypass the cache
+    unless `cache_sampled` is set.
+    """
+
+    # remote backends whose default temperature samples
+    SAMPLING_BACKENDS = ('lmm_gpt4v',)
+
+    def __init__(self, lmm, db_path='cache/lmm_cache.sqlite', max_bytes=256 * 1024**2, backend=None, model_id=None,
+                 cache_sampled=False):
+        self.lmm = lmm
+        self.backend = backend if backend is not None else type(lmm).__name__
+        self.model_id = model_id if model_id is not None else getattr(lmm, 'model_path', '')
+        self.max_bytes = max_bytes
+        self.cache_sampled = cache_sampled
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS responses '
+                        '(key TEXT PRIMARY KEY, answers TEXT, size INTEGER, last_access REAL)')
+        self.db.commit()
+
+    def __getattr__(self, name):
+        # only reached for missing attributes; `lmm` itself is missing while unpickling
+        if name == 'lmm':
+            raise AttributeError(name)
+        return getattr(self.lmm, name)
+
+    def key(self, question, image, settings):
+        return hashlib.sha256(json.dumps({
+            'backend': self.backend,
+            'model': self.model_id,
+            'question': question,
+            'image': image_hash(image),
+            'settings': settings,
+        }, sort_keys=True).encode()).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            row = self.db.execute('SELECT answers FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            self.db.execute('UPDATE responses SET last_access = ? WHERE key = ?', (time.time(), key))
+            self.db.commit()
+        return json.loads(row[0])
+
+    def put(self, key, answers):
+        value = json.dumps(answers)
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)',
+                            (key, value, len(value.encode()), time.time()))
+            self.evict()
+            self.db.commit()
+
+    def evict(self):
+        total = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self.db.execute('SELECT key, size FROM responses ORDER BY last_access').fetchall():
+            if total <= self.max_bytes:
+                break
+            self.db.execute('DELETE FROM responses WHERE key = ?', (key,))
+            total -= size
+
+    def inference(self, question: str, image, temperature=None):
+        return self.inference_batch([question], [image], temperature=temperature)[0]
+
+    def inference_batch(self, questions, images, num_return_sequences=1, do_sample=None, temperature=None, **kwargs):
+        sampled = num_return_sequences > 1 or bool(do_sample) or \
+            (self.backend in self.SAMPLING_BACKENDS and temperature != 0)
+        call_kwargs = dict(kwargs)
+        if num_return_sequences != 1:
+            call_kwargs['num_return_sequences'] = num_return_sequences
+        if do_sample is not None:
+            call_kwargs['do_sample'] = do_sample
+        if temperature is not None:
+            call_kwargs['temperature'] = temperature
+        if sampled and not self.cache_sampled:
+            return self.lmm.inference_batch(questions, images, **call_kwargs)
+
+        settings = {'num_return_sequences': num_return_sequences, 'do_sample': do_sample, 'temperature': temperature,
+                    **kwargs}
+        keys = [self.key(question, image, settings) for question, image in zip(questions, images)]
+        answers = [self.get(key) for key in keys]
+        misses = [idx for idx, answer in enumerate(answers) if answer is None]
+        with self.lock:
+            self.hits += len(keys) - len(misses)
+            self.misses += len(misses)
+        if misses:
+            computed = self.lmm.inference_batch([questions[idx] for idx in misses], [images[idx] for idx in misses],
+                                                **call_kwargs)
+            for n, idx in enumerate(misses):
+                answers[idx] = computed[n * num_return_sequences:(n + 1) * num_return_sequences]
+                self.put(keys[idx], answers[idx])
+        return [answer for pair_answers in answers for answer in pair_answers]
+
+    def image_caption(self, image):
+        image_caption_prompt = 'Describe the details of this image in detail, including the color, pose, lighting, and environment of the target object.'
+        return self.inference(image_caption_prompt, image, temperature=0)
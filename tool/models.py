@@ -0,0 +1,472 @@
+import asyncio
+import base64
+import datetime
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from PIL import Image
+
+from http_client import DEFAULT_TIMEOUT, AsyncHTTP, get_bytes, get_session, post_json
+
+
+def log(text):
+    print(f'\n[IDEA-2-3D]: {text}')
+
+
+def concatenate_images_with_number_label(images_list, direction="h", output_folder=None):
+    # Check if images_list contains PIL images
+    if not all(isinstance(image, Image.Image) for image in images_list):
+        raise ValueError("All images in images_list must be PIL images.")
+
+    # Check direction parameter
+    if direction not in ["h", "v"]:
+        raise ValueError("Invalid direction parameter. It must be 'h' for horizontal or 'v' for vertical concatenation.")
+
+    # Check if we're concatenating horizontally or vertically and create a canvas
+    if direction == "h":
+        total_width = sum(image.size[0] for image in images_list)
+        max_height = max(image.size[1] for image in images_list)
+        concatenated_image = Image.new('RGB', (total_width, max_height))
+    elif direction == "v":
+        total_height = sum(image.size[1] for image in images_list)
+        max_width = max(image.size[0] for image in images_list)
+        concatenated_image = Image.new('RGB', (max_width, total_height))
+
+    # Paste images onto the canvas
+    x_offset, y_offset = 0, 0
+    for image in images_list:
+        concatenated_image.paste(image, (x_offset, y_offset))
+        if direction == "h":
+            x_offset += image.size[0]
+        elif direction == "v":
+            y_offset += image.size[1]
+
+    # Save the image when an output folder is given
+    if output_folder is not None:
+        os.makedirs(output_folder, exist_ok=True)
+        timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S%f")
+        output_path = os.path.join(output_folder, f"concatenated_image-{timestamp}.png")
+        log(f'concatenated_image output_path={output_path}')
+        concatenated_image.save(output_path)
+
+    return concatenated_image
+
+
+class lmm_gpt4v:
+    def __init__(self, api_key='', model_path="gpt-4-vision-preview", max_concurrency=8, timeout=DEFAULT_TIMEOUT):
+        self.api_key = api_key
+        self.model_path = model_path
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        # pooled keep-alive connections with retries on 429/5xx, see http_client.py
+        self.session = get_session()
+        self.async_http = AsyncHTTP(pool_size=max_concurrency, timeout=timeout)
+
+    def encode_image(self, image):
+        """Encode PIL image to base64, converting RGBA images to RGB."""
+        if image.mode == 'RGBA':
+            image = image.convert('RGB')
+        buffered = BytesIO()
+        image.save(buffered, format="JPEG")
+        return base64.b64encode(buffered.getvalue()).decode('utf-8')
+
+    def request(self, question: str, image, temperature=None):
+        """Headers and payload of a GPT-4 Vision request with an image and a question.
+
+        `image=None` sends the question alone. `temperature=None` leaves the API
+        default, which samples.
+        """
+        if type(image) == list:
+            image = concatenate_images_with_number_label(image)
+
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}"
+        }
+
+        payload = {
+            "model": self.model_path,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "text",
+                            "text": question
+                        }
+                    ]
+                }
+            ],
+            "max_tokens": 300
+        }
+        if image is not None:
+            payload["messages"][0]["content"].append({
+                "type": "image_url",
+                "image_url": {
+                    "url": f"data:image/jpeg;base64,{self.encode_image(image)}"
+                }
+            })
+        if temperature is not None:
+            payload["temperature"] = temperature
+        return headers, payload
+
+    def inference(self, question: str, image, temperature=None):
+        """Make an inference request to the GPT-4 Vision API with an image and a question."""
+        headers, payload = self.request(question, image, temperature)
+        response = post_json("https://api.openai.com/v1/chat/completions", payload, headers=headers,
+                             session=self.session, timeout=self.timeout)
+        return response['choices'][0]['message']['content']
+
+    async def ainference(self, question: str, image, temperature=None):
+        headers, payload = self.request(question, image, temperature)
+        response = await self.async_http.post_json("https://api.openai.com/v1/chat/completions", payload,
+                                                   headers=headers)
+        return response['choices'][0]['message']['content']
+
+    def inference_batch(self, questions, images, num_return_sequences=1, temperature=None):
+        """Answer several (question, image) pairs, `num_return_sequences` answers each.
+
+        The API is called once per answer, up to `max_concurrency` calls in
+        flight over the pooled session; answers are grouped per pair.
+        """
+        pairs = [(question, image) for question, image in zip(questions, images) for _ in range(num_return_sequences)]
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_concurrency, len(pairs)))) as executor:
+            return list(executor.map(lambda pair: self.inference(*pair, temperature), pairs))
+
+    async def ainference_batch(self, questions, images, num_return_sequences=1, temperature=None):
+        # asyncio variant of inference_batch, for callers that already run an event loop
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def answer(question, image):
+            async with semaphore:
+                return await self.ainference(question, image, temperature)
+
+        return await asyncio.gather(*[answer(question, image)
+                                      for question, image in zip(questions, images)
+                                      for _ in range(num_return_sequences)])
+
+
+class lmm_llava_batch():
+    """Batched `generate` shared by the LLaVA wrappers, which define `prompt` and `parse`."""
+
+    def inference_batch(self, questions, images, num_return_sequences=1, do_sample=None, max_batch_size=8,
+                        temperature=None):
+        """Answer several (question, image) pairs in padded `generate` calls.
+
+        Each pair gets `num_return_sequences` answers, grouped per pair. Several
+        answers to one pair are sampled (`do_sample` defaults to True then),
+        otherwise decoding is greedy as in `inference`; `temperature=0` is
+        always greedy. Pairs whose image is None are asked as text only.
+        """
+        images = [concatenate_images_with_number_label(image) if type(image) == list else image for image in images]
+        text_only = [idx for idx, image in enumerate(images) if image is None]
+        if 0 < len(text_only) < len(images):
+            # the processor takes either an image for every prompt or none at all
+            with_image = [idx for idx, image in enumerate(images) if image is not None]
+            answers = [None] * len(images)
+            for group in [text_only, with_image]:
+                group_answers = self.inference_batch([questions[idx] for idx in group], [images[idx] for idx in group],
+                                                     num_return_sequences, do_sample, max_batch_size, temperature)
+                for n, idx in enumerate(group):
+                    answers[idx] = group_answers[n * num_return_sequences:(n + 1) * num_return_sequences]
+            return [answer for pair_answers in answers for answer in pair_answers]
+        has_image = len(text_only) == 0
+        if temperature == 0:
+            do_sample = False
+        elif do_sample is None:
+            do_sample = num_return_sequences > 1
+        sampling = {'temperature': temperature} if do_sample and temperature is not None else {}
+        # decoder-only generation continues from the right, so pad on the left
+        self.processor.tokenizer.padding_side = "left"
+        answers = []
+        for b in range(0, len(questions), max_batch_size):
+            prompts = [self.prompt(question, has_image) for question in questions[b:b + max_batch_size]]
+            inputs = self.processor(text=prompts, images=images[b:b + max_batch_size] if has_image else None,
+                                    padding=True, return_tensors="pt").to(f"cuda:{self.gpuid}")
+            output = self.model.generate(**inputs, max_new_tokens=1000, do_sample=do_sample,
+                                         num_return_sequences=num_return_sequences, **sampling)
+            answers += [self.parse(res) for res in self.processor.batch_decode(output, skip_special_tokens=True)]
+        return answers
+
+
+class lmm_llava_34b(lmm_llava_batch):
+
+    def __init__(self, model_path = "llava-hf/llava-v1.6-34b-hf", gpuid = 0):
+        self.gpuid = gpuid
+        self.model_path = model_path
+        import torch
+        from transformers import LlavaNextProcessor, LlavaNextForConditionalGeneration
+        self.processor = LlavaNextProcessor.from_pretrained(model_path)
+        self.model = LlavaNextForConditionalGeneration.from_pretrained(model_path, torch_dtype=torch.float16, low_cpu_mem_usage=True)
+        self.model.to(f"cuda:{gpuid}")
+
+    def inference(self, question: str, images_list, temperature=None):
+        if type(images_list) == list:
+            image = concatenate_images_with_number_label(images_list)
+        else:
+            image = images_list
+
+        return self.inference_batch([question], [image], temperature=temperature)[0]
+
+    def prompt(self, question, has_image=True):
+        image = "<image>\n" if has_image else ""
+        return f"<|im_start|>system\nAnswer the questions.<|im_end|><|im_start|>user\n{image}{question}<|im_end|><|im_start|>assistant\n"
+
+    def parse(self, res):
+        content = res
+        start_index = res.find("<|im_start|> assistant\n")
+        if start_index != -1:
+            content = res[start_index + len("<|im_start|> assistant\n"):]
+        return content
+
+    def image_caption(self, image):
+        image_caption_prompt = 'Describe the details of this image in detail, including the color, pose, lighting, and environment of the target object.'
+        return self.inference(image_caption_prompt, image, temperature=0)
+    pass
+
+
+class lmm_llava_7b(lmm_llava_batch):
+
+    def __init__(self, model_path = "llava-hf/llava-v1.6-mistral-7b-hf", gpuid = 0):
+        self.gpuid = gpuid
+        self.model_path = model_path
+        import torch
+        from transformers import LlavaNextProcessor, LlavaNextForConditionalGeneration
+        self.processor = LlavaNextProcessor.from_pretrained(model_path)
+        self.model = LlavaNextForConditionalGeneration.from_pretrained(model_path, torch_dtype=torch.float16, low_cpu_mem_usage=True)
+        self.model.to(f"cuda:{gpuid}")
+
+    def inference(self, question: str, images_list, temperature=None):
+        if type(images_list) == list:
+            image = concatenate_images_with_number_label(images_list)
+        else:
+            image = images_list
+
+        return self.inference_batch([question], [image], temperature=temperature)[0]
+
+    def prompt(self, question, has_image=True):
+        image = "<image>\n" if has_image else ""
+        return f"[INST] {image}{question} [/INST]"
+
+    def parse(self, res):
+        result = re.search(r'\[/INST\](.*)', res)
+        if result:
+            res = result.group(1)
+        return res
+
+    def image_caption(self, image):
+        image_caption_prompt = 'Describe the details of this image in detail, including the color, pose, lighting, and environment of the target object.'
+        return self.inference(image_caption_prompt, image, temperature=0)
+    pass
+
+
+class text2img_sdxl():
+    def __init__(self, sdxl_base_path='stabilityai/stable-diffusion-xl-base-1.0', sdxl_refiner_path='stabilityai/stable-diffusion-xl-refiner-1.0', gpuid=1,variant="fp16"):
+        import torch
+        from diffusers import DiffusionPipeline
+        self.sdxl_base_path=sdxl_base_path
+        self.sdxl_refiner_path=sdxl_refiner_path
+        self.gpuid=gpuid
+        # load both base & refiner
+        self.base = DiffusionPipeline.from_pretrained(
+            sdxl_base_path,
+            torch_dtype=torch.float32,
+            # variant="fp16",
+            use_safetensors=True
+        )
+        self.base.to(f"cuda:{gpuid}")
+        self.refiner = DiffusionPipeline.from_pretrained(
+            sdxl_refiner_path,
+            text_encoder_2=self.base.text_encoder_2,
+            vae=self.base.vae,
+            torch_dtype=torch.float32,
+            use_safetensors=True,
+            # variant="fp16",
+        )
+        self.refiner.to(f"cuda:{gpuid}")
+
+    def inference(self, prompt):
+        # Define how many steps and what % of steps to be run on each experts (80/20) here
+        n_steps = 40
+        high_noise_frac = 0.8
+
+        # run both experts
+        image = self.base(
+            prompt=prompt,
+            num_inference_steps=n_steps,
+            denoising_end=high_noise_frac,
+            output_type="latent",
+        ).images
+        image = self.refiner(
+            prompt=prompt,
+            num_inference_steps=n_steps,
+            denoising_start=high_noise_frac,
+            image=image,
+        ).images[0]
+
+        return image
+
+    def inference_batch(self, prompts, num_images_per_prompt=1, max_batch_size=4):
+        """Generate `num_images_per_prompt` images for each prompt, grouped per prompt.
+
+        Base (latent output) and refiner run over micro-batches of at most
+        `max_batch_size` images; per-image latency and throughput are logged.
+        """
+        n_steps = 40
+        high_noise_frac = 0.8
+
+        prompts = [prompt for prompt in prompts for _ in range(num_images_per_prompt)]
+        images = []
+        start_time = time.time()
+        for b in range(0, len(prompts), max_batch_size):
+            batch = prompts[b:b + max_batch_size]
+            batch_start_time = time.time()
+            latents = self.base(
+                prompt=batch,
+                num_inference_steps=n_steps,
+                denoising_end=high_noise_frac,
+                output_type="latent",
+            ).images
+            images += self.refiner(
+                prompt=batch,
+                num_inference_steps=n_steps,
+                denoising_start=high_noise_frac,
+                image=latents,
+            ).images
+            batch_time = time.time() - batch_start_time
+            log(f't2i micro-batch of {len(batch)}: {batch_time / len(batch):.2f}s/image, '
+                f'{len(batch) / batch_time:.3f} images/s')
+        total_time = time.time() - start_time
+        if prompts:
+            log(f't2i batch of {len(prompts)} images (max_batch_size={max_batch_size}): '
+                f'{total_time / len(prompts):.2f}s/image, {len(prompts) / total_time:.3f} images/s')
+        return images
+
+    pass
+
+
+class text2img_sdxl_replicate():
+    def __init__(self, replicate_key='see https://replicate.com/stability-ai/sdxl/api', max_concurrency=4,
+                 timeout=DEFAULT_TIMEOUT):
+        import replicate
+
+        self.replicate_key=replicate_key
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        # one client (and connection pool) for every prediction
+        self.client = replicate.Client(api_token=self.replicate_key)
+        self.session = get_session()
+        self.async_http = AsyncHTTP(pool_size=max_concurrency, timeout=timeout)
+
+    def input(self, prompt):
+        return {
+            "width": 1024,
+            "height": 1024,
+            "prompt": prompt,
+            "refine": "expert_ensemble_refiner",
+            "apply_watermark": False,
+            "num_inference_steps": 25
+        }
+
+    def inference(self, prompt):
+        output = self.client.run(
+            "stability-ai/sdxl:39ed52f2a78e934b3ba6e2a89f5b1c712de7dfea535525255b1aa35c5565e08b",
+            input=self.input(prompt)
+        )
+
+        image_data = BytesIO(get_bytes(str(output[0]), session=self.session, timeout=self.timeout))
+        image = Image.open(image_data)
+
+        return image
+
+    async def ainference(self, prompt):
+        output = await self.client.async_run(
+            "stability-ai/sdxl:39ed52f2a78e934b3ba6e2a89f5b1c712de7dfea535525255b1aa35c5565e08b",
+            input=self.input(prompt)
+        )
+        return Image.open(BytesIO(await self.async_http.get_bytes(str(output[0]))))
+
+    def inference_batch(self, prompts, num_images_per_prompt=1, max_batch_size=4):
+        # one prediction per image, up to max_concurrency in flight; grouped per prompt like text2img_sdxl.inference_batch
+        prompts = [prompt for prompt in prompts for _ in range(num_images_per_prompt)]
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_concurrency, len(prompts)))) as executor:
+            return list(executor.map(self.inference, prompts))
+
+    async def ainference_batch(self, prompts, num_images_per_prompt=1):
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def generate(prompt):
+            async with semaphore:
+                return await self.ainference(prompt)
+
+        return await asyncio.gather(*[generate(prompt) for prompt in prompts for _ in range(num_images_per_prompt)])
+
+    pass
+
+
+class img23d_TripoSR():
+
+    def __init__(self, model_path = 'stabilityai/TripoSR', gpuid=1, **engine_kwargs):
+        from i23d.TripoSR.run import TripoSREngine
+        self.gpuid = gpuid
+        self.model_path = model_path
+        # load TSR + rembg once and keep them resident for every draft
+        self.engine = TripoSREngine(gpuid, model_path, **engine_kwargs)
+
+    def inference(self, png_path, output_path):
+        return self.engine.inference(png_path, output_path)
+
+    def inference_batch(self, png_paths, output_paths):
+        # all drafts of an iteration share one backbone forward pass
+        return self.engine.inference_batch(png_paths, output_paths)
+
+    pass
+
+
+def readimage(path):
+    with open(path, 'rb') as file:
+        image = Image.open(path).convert("RGB")
+        resized_image = image.resize((256, 256))
+    return resized_image
+
+
+def writeimage(image, path):
+    # Check if the directory exists, and create it if it doesn't
+    directory = os.path.dirname(path)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    # Save the image to the path
+    with open(path, 'wb') as file:
+        image.save(file, 'PNG')  # Use 'PNG' to ensure proper saving of PNG files
+
+
+class Memory():
+    idea_input_imglist = []
+    idea_input_img = None
+    idea_input_prompt = ''
+
+    best_img = None
+    best_prompt = None
+    best_3d_path = None
+
+    feedback = ''
+    pass
+
+
+class Iter():
+    def __init__(self, index):
+        self.index = index
+        self.clear()
+
+    def clear(self):
+        self.idea_input_imglist = []
+        self.prompt = []
+        self.draft_img = []
+        self.draft_3d_path = []
+        self.best_img = None
+        self.best_3d_path = ''
+        self.best_prompt = ''
@@ -0,0 +1,389 @@
+import json
+import os
+import queue
+import re
+import shutil
+import threading
+import time
+
+from models import Iter, Memory, concatenate_images_with_number_label, log, readimage, writeimage
+
+
+class Locked():
+    """Serializes calls into a model that owns one device.
+
+    Several cases run in their own threads and share the LMM, T2I and I23D
+    models; wrapping each model in its own lock lets one case wait on the LMM
+    while another uses the T2I or I23D device. Call counts and busy time are
+    accumulated for throughput reports.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.busy_time = 0.0
+
+    def __getattr__(self, name):
+        attr = getattr(self.model, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            with self.lock:
+                start_time = time.time()
+                try:
+                    return attr(*args, **kwargs)
+                finally:
+                    self.calls += 1
+                    self.busy_time += time.time() - start_time
+        return call
+
+
+class Manifest():
+    """Durable per-stage checkpoints of one case, kept in `{outpath}/manifest.json`.
+
+    The captions, each iteration's prompts, every draft's T2I image and I23D
+    mesh, and each iteration's selection and feedback are recorded as they
+    finish, so a restarted run skips them and continues from the first stage
+    that did not. Every update rewrites the file atomically (temp file +
+    `os.replace`), so a crash never leaves a half-written manifest. A manifest
+    written with a different `config` (idea, number of drafts/images) is
+    discarded. With `outpath=None` nothing is written.
+    """
+
+    def __init__(self, outpath=None, config=None, resume=True):
+        self.path = os.path.join(outpath, 'manifest.json') if outpath is not None else None
+        self.lock = threading.Lock()
+        self.data = {'config': config, 'stages': {}}
+        if resume and self.path is not None and os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            if data.get('config') == config:
+                self.data = data
+            else:
+                log(f'{self.path} was written with another config, starting over.')
+
+    def get(self, *keys):
+        value = self.data['stages']
+        for key in keys:
+            if not isinstance(value, dict) or str(key) not in value:
+                return None
+            value = value[str(key)]
+        return value
+
+    def put(self, *keys, value):
+        with self.lock:
+            node = self.data['stages']
+            for key in keys[:-1]:
+                node = node.setdefault(str(key), {})
+            node[str(keys[-1])] = value
+            self.save()
+
+    def save(self):
+        if self.path is None:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+
+class StagedExecutor():
+    """Runs items through a chain of stages, one thread per stage.
+
+    `stages` is a list of `(name, fn, max_batch)`; `fn` takes a list of up to
+    `max_batch` items (whatever is waiting in the stage's queue) and returns a
+    list of output items for the next stage, which may be longer (fan-out).
+    Stages are connected by queues of at most `max_queue_size` items, so an
+    early stage can only run that far ahead of a slow one. `run` returns the
+    outputs of the last stage once every item has passed through all stages,
+    and re-raises the first error of any stage. The stages only see plain
+    Python objects, so stub models work in place of the real ones.
+    """
+
+    _DONE = object()
+
+    def __init__(self, stages, max_queue_size=2):
+        self.stages = stages
+        self.max_queue_size = max_queue_size
+        self.stats = {name: {'items': 0, 'calls': 0, 'busy_time': 0.0} for name, _, _ in stages}
+
+    def _worker(self, name, fn, max_batch, q_in, q_out, errors):
+        done = False
+        while not done:
+            batch = [q_in.get()]
+            while len(batch) < max_batch:
+                try:
+                    batch.append(q_in.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is self._DONE:
+                batch.pop()
+                done = True
+            if batch and not errors:
+                start_time = time.time()
+                try:
+                    outputs = fn(batch)
+                except Exception as e:
+                    errors.append(e)
+                    outputs = []
+                stats = self.stats[name]
+                stats['items'] += len(batch)
+                stats['calls'] += 1
+                stats['busy_time'] += time.time() - start_time
+                for output in outputs:
+                    q_out.put(output)
+        q_out.put(self._DONE)
+
+    def run(self, items):
+        queues = [queue.Queue(maxsize=self.max_queue_size) for _ in self.stages]
+        queues.append(queue.Queue())
+        errors = []
+        threads = [
+            threading.Thread(target=self._worker, args=(name, fn, max_batch, queues[s], queues[s + 1], errors),
+                             daemon=True)
+            for s, (name, fn, max_batch) in enumerate(self.stages)
+        ]
+        for thread in threads:
+            thread.start()
+        for item in items:
+            queues[0].put(item)
+        queues[0].put(self._DONE)
+
+        results = []
+        while True:
+            output = queues[-1].get()
+            if output is self._DONE:
+                break
+            results.append(output)
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+        return results
+
+
+def prepare_case(lmm, IDEApath, outpath, name='', manifest=None):
+    """Caption the `<IMG>` tags of `{IDEApath}/idea.txt` and build the case memory."""
+    manifest = manifest if manifest is not None else Manifest()
+
+    def clog(text):
+        log(f'{name}: {text}' if name else text)
+
+    with open(f'{IDEApath}/idea.txt', 'r') as file:
+        IdeaContent = file.read()
+
+    if len(IdeaContent.strip()) == 0:
+        raise ValueError(f'empty idea.txt in {IDEApath}')
+
+    memory = Memory()
+
+    prompt_imagecaption = 'Describe the image in detail.'
+
+    img_tags = re.findall(r'<IMG>(.*?)<\/IMG>', IdeaContent)
+    obj_tags = re.findall(r'<OBJ>(.*?)<\/OBJ>', IdeaContent)
+
+    # all images of the idea are captioned in one batched LMM call
+    img_list = [readimage(f'{IDEApath}/{img_tag}') for img_tag in img_tags]
+    captions = manifest.get('captions')
+    if captions is None:
+        # captions, selection and feedback are asked at temperature 0: deterministic, and cacheable for GPT-4V
+        captions = (lmm.inference_batch([prompt_imagecaption] * len(img_list), img_list, temperature=0)
+                    if img_list else [])
+        manifest.put('captions', value=captions)
+    for img_tag, caption in zip(img_tags, captions):
+        IdeaContent = IdeaContent.replace(f'<IMG>{img_tag}</IMG>', f'[{caption}]')
+
+    for obj_tag in obj_tags:
+        # 3D model inputs are not supported yet; their tags stay in the prompt
+        clog(f'ignoring unsupported <OBJ> input {obj_tag}')
+
+    memory.idea_input_imglist = img_list
+    # text-only ideas (no <IMG> tag) have no input image; the LMM is then asked without one
+    memory.idea_input_img = (concatenate_images_with_number_label(img_list, output_folder=f'{outpath}/tmp')
+                             if img_list else None)
+    memory.idea_input_prompt = IdeaContent
+    clog(f'init input prompt = {IdeaContent}')
+    return memory
+
+
+def select_best_row(answer, n_rows, default):
+    # the LMM is asked for a row number; fall back to `default` when it answers
+    # with anything else and clamp to the rows that exist
+    try:
+        best_row = int(answer)
+    except ValueError:
+        log('Failed to parse best_row as an integer. Using default value.')
+        best_row = default
+    return min(max(best_row, 0), n_rows - 1)
+
+
+def render_sheet(out3dpath, outpath):
+    #  the 6 rendered views of a draft side by side, one row of the selection image
+    img_render_list = [readimage(f"{out3dpath}/render_00{idx}.png") for idx in range(6)]
+    return concatenate_images_with_number_label(img_render_list, output_folder=f'{outpath}/tmp')
+
+
+def run_iteration(lmm, t2i, i23d, memory, outpath, i, num_img, num_draft, name='', max_queue_size=2,
+                  t2i_batch_size=1, manifest=None):
+    """One round of prompt generation, drafts, 3D lifting, selection and feedback.
+
+    Returns True when the LMM accepts the best draft ("no revision"). Each T2I
+    call draws the images of up to `t2i_batch_size` prompts; 1 keeps the most
+    overlap with I23D, larger values use the SDXL micro-batches. Stages already
+    recorded in `manifest` (see `Manifest`) are not run again.
+    """
+    def clog(text):
+        log(f'{name}: {text}' if name else text)
+
+    manifest = manifest if manifest is not None else Manifest()
+    stage = f'iter-{i}'
+    iters = Iter(i)
+
+    def generate_prompts(batch):
+        if memory.idea_input_img is None and i == 0:
+            question = f'Optimize text descriptions to better match user input [User Input]{memory.idea_input_prompt}[/User Input]. Answers are 75 words or less.'
+        elif memory.idea_input_img is None:
+            question = f'Optimize prompt [Prompt]{memory.best_prompt}[/Prompt] to better match user input [User Input]{memory.idea_input_prompt}[/User Input]. Here\'s the revision [feedback]{memory.feedback}[/feedback]. Answers are 75 words or less.'
+        elif i == 0: # initial round
+            question = f'Optimize text descriptions based on image content and details to better match user input [User Input]{memory.idea_input_prompt}[/User Input] and images. Answers are 75 words or less.'
+        else:
+            # The second round starts with memory+idea input, and the image and best prompt of the best model from the previous round.
+            question = f'Optimize prompt [Prompt]{memory.best_prompt}[/Prompt] based on image content and details to better match user input [User Input]{memory.idea_input_prompt}[/User Input] and images. The first line of the image is the user input. Here\'s the revision [feedback]{memory.feedback}[/feedback]. Answers are 75 words or less.'
+        prompts = manifest.get(stage, 'prompts')
+        if prompts is None:
+            # the num_draft prompts share question and image, so they are sampled in one call
+            prompts = lmm.inference_batch([question], [memory.idea_input_img], num_return_sequences=num_draft)
+            manifest.put(stage, 'prompts', value=prompts)
+        for IdeaContent in prompts:
+            clog(f'new input prompt = {IdeaContent}')
+        return [{'k': k, 'prompt': IdeaContent} for k, IdeaContent in enumerate(prompts)]
+
+    def saved_draft(k, j, key):
+        # a checkpointed draft whose `key` output is still on disk, else None
+        draft = manifest.get(stage, 'drafts', f'{k}-{j}')
+        if draft is None or key not in draft or not os.path.exists(draft[key]):
+            return None
+        return dict(draft)
+
+    def generate_images(batch):
+        saved = {(item['k'], j): saved_draft(item['k'], j, 'imgpath') for item in batch for j in range(num_img)}
+        todo = [item for item in batch if any(saved[(item['k'], j)] is None for j in range(num_img))]
+        # Each prompt generates n charts, up to t2i_batch_size prompts per T2I call
+        images = t2i.inference_batch([item['prompt'] for item in todo], num_images_per_prompt=num_img) if todo else []
+        for n, image in enumerate(images):
+            item, j = todo[n // num_img], n % num_img
+            out3dpath = f"{outpath}/draft/iter-{i+1}-{item['k']}-{j}"
+            writeimage(image, f'{out3dpath}/draft.png')
+            draft = {'k': item['k'], 'j': j, 'prompt': item['prompt'],
+                     'imgpath': f'{out3dpath}/draft.png', 'out3dpath': out3dpath}
+            manifest.put(stage, 'drafts', f"{item['k']}-{j}", value=draft)
+            saved[(item['k'], j)] = dict(draft)
+        return [saved[(item['k'], j)] for item in batch for j in range(num_img)]
+
+    def lift_to_3d(batch):
+        todo = []
+        for n, draft in enumerate(batch):
+            saved = saved_draft(draft['k'], draft['j'], 'mesh_path')
+            if saved is None:
+                todo.append(draft)
+            else:
+                batch[n] = saved
+        # drafts that are ready together share one I23D call
+        mesh_paths = i23d.inference_batch([draft['imgpath'] for draft in todo],
+                                          [draft['out3dpath'] for draft in todo]) if todo else []
+        for draft, mesh_path in zip(todo, mesh_paths):
+            draft['mesh_path'] = mesh_path
+            manifest.put(stage, 'drafts', f"{draft['k']}-{draft['j']}", 'mesh_path', value=mesh_path)
+        for draft in batch:
+            #  Save 6 rendered images, and then filter, filter out the best prompt into memory.
+            draft['img'] = render_sheet(draft['out3dpath'], outpath)
+        return batch
+
+    # draft k+1 is drawn while draft k is lifted to 3D; selection starts only
+    # once every draft of the iteration is done
+    executor = StagedExecutor([('lmm', generate_prompts, 1), ('t2i', generate_images, t2i_batch_size),
+                               ('i23d', lift_to_3d, max(1, num_draft * num_img))],
+                              max_queue_size=max_queue_size)
+    drafts = sorted(executor.run([{}]), key=lambda d: (d['k'], d['j']))
+    for draft in drafts:
+        iters.prompt.append(draft['prompt'])
+        iters.draft_3d_path.append(draft['mesh_path'])
+        iters.draft_img.append(draft['img'])
+
+    # The best model of the previous round competes as the last row.
+    if memory.best_3d_path != None:
+        iters.prompt.append(memory.best_prompt)
+        iters.draft_img.append(memory.best_img)
+        iters.draft_3d_path.append(memory.best_3d_path)
+
+    draft_img_comp = concatenate_images_with_number_label(iters.draft_img, 'v', output_folder=f'{outpath}/tmp')
+
+    # Selection of the best draft model for the current round
+    n_rows = len(iters.draft_img)
+    prompt_select = f'Each row of these images shows 6 views of a 3D model. Which row of images best meets the user input? [User Input]{memory.idea_input_prompt}[/User Input]. Only return a number in the list {[kj for kj in range(n_rows)]}, the number of rows. Such as, \"1\" or \"0\".'
+    best_row = manifest.get(stage, 'best_row')
+    if best_row is None:
+        best_row = select_best_row(lmm.inference(prompt_select, draft_img_comp, temperature=0), n_rows,
+                                   0 if i == 0 else n_rows - 1)
+        manifest.put(stage, 'best_row', value=best_row)
+    clog(f'best_row = {best_row}')
+
+    # rows are drafts in generation order, followed by the previous best
+    memory.best_prompt = iters.prompt[best_row]
+    memory.best_img = iters.draft_img[best_row]
+    memory.best_3d_path = iters.draft_3d_path[best_row]
+    clog(f'memory.best_3d_path = {memory.best_3d_path}')
+
+    # Determine if the output condition is met
+    # Give feedback
+    prompt_feedback = f'Does the diagram satisfy the user input? [User Input]{memory.idea_input_prompt}[/User Input]. Returns "no revision" if it matches the User Input. Give the correct prompt if it does not.'
+    feedback = manifest.get(stage, 'feedback')
+    if feedback is None:
+        feedback = lmm.inference(prompt_feedback, memory.best_img, temperature=0)
+        manifest.put(stage, 'feedback', value=feedback)
+    clog(f'feedback answer = {feedback}')
+    if 'no revision' in feedback:
+        return True
+    memory.feedback = feedback
+    return False
+
+
+def finish_case(memory, outpath, name='', manifest=None):
+    # End of iteration, save memory best model to outputs
+    ext = os.path.splitext(memory.best_3d_path)[1]
+    shutil.copyfile(memory.best_3d_path, f'{outpath}/mesh{ext}')
+    if manifest is not None:
+        manifest.put('mesh', value=f'{outpath}/mesh{ext}')
+    log(f'{name}: finished! check the path {outpath}/mesh{ext}')
+    return f'{outpath}/mesh{ext}'
+
+
+def case_manifest(IDEApath, outpath, num_img, num_draft, resume=True):
+    # checkpoints are only reused for the same idea and the same number of drafts
+    with open(f'{IDEApath}/idea.txt', 'r') as file:
+        idea = file.read()
+    return Manifest(outpath, config={'idea': idea, 'num_img': num_img, 'num_draft': num_draft}, resume=resume)
+
+
+def run_case(lmm, t2i, i23d, IDEApath, outpath, num_img=1, num_draft=3, max_iters=5, name='', t2i_batch_size=1,
+             resume=True):
+    """Run the whole Idea-to-3D loop for one case and return the final mesh path.
+
+    With `resume`, stages checkpointed in `{outpath}/manifest.json` by an
+    earlier run are replayed from disk instead of calling the models again.
+    """
+    os.makedirs(outpath, exist_ok=True)
+    manifest = case_manifest(IDEApath, outpath, num_img, num_draft, resume=resume)
+    memory = prepare_case(lmm, IDEApath, outpath, name=name, manifest=manifest)
+    for i in range(max_iters):
+        log(f'{name}: iter = {i}')
+        if run_iteration(lmm, t2i, i23d, memory, outpath, i, num_img, num_draft, name=name,
+                         t2i_batch_size=t2i_batch_size, manifest=manifest):
+            log(f'{name}: output no revison , finish.')
+            break
+    return finish_case(memory, outpath, name=name, manifest=manifest)
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# tests import the pipeline modules the way run_batch.py does
+tool_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if tool_dir not in sys.path:
+    sys.path.append(tool_dir)
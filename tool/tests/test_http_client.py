@@ -0,0 +1,86 @@
+import asyncio
+import gc
+import json
+import threading
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from http_client import AsyncHTTP, make_session, post_json
+
+
+@pytest.fixture
+def flaky_server():
+    """Local server answering 429, then 503, to the first two requests of each path, then 200."""
+    failures = {}
+
+    class Handler(BaseHTTPRequestHandler):
+        def reply(self):
+            failures[self.path] = failures.get(self.path, 0) + 1
+            if failures[self.path] <= 2:
+                self.send_response([429, 503][failures[self.path] - 1])
+                self.send_header('Retry-After', '0')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            body = json.dumps({'path': self.path}).encode()
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        do_GET = do_POST = reply
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_port}', failures
+    server.shutdown()
+    server.server_close()
+
+
+def test_post_json_retries(flaky_server):
+    base, failures = flaky_server
+    session = make_session(backoff_factor=0.01)
+    with ThreadPoolExecutor(8) as executor:
+        answers = list(executor.map(lambda n: post_json(f'{base}/sync/{n}', {}, session=session), range(8)))
+    assert [answer['path'] for answer in answers] == [f'/sync/{n}' for n in range(8)]
+    assert failures == {f'/sync/{n}': 3 for n in range(8)}
+
+
+def test_async_post_json_retries(flaky_server):
+    base, failures = flaky_server
+
+    async def main():
+        client = AsyncHTTP(backoff_factor=0.01)
+        answers = await asyncio.gather(*[client.post_json(f'{base}/async/{n}', {}) for n in range(8)])
+        await client.close()
+        return answers
+
+    answers = asyncio.run(main())
+    assert [answer['path'] for answer in answers] == [f'/async/{n}' for n in range(8)]
+    assert failures == {f'/async/{n}': 3 for n in range(8)}
+
+
+def test_async_sessions_do_not_outlive_their_loop(flaky_server):
+    base, _ = flaky_server
+    client = AsyncHTTP(backoff_factor=0.01)
+    unclosed = []
+
+    async def main(n):
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: unclosed.append(context))
+        return await client.post_json(f'{base}/loop/{n}', {})
+
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        # no close(): each asyncio.run closes its loop with the session still registered
+        for n in range(3):
+            assert asyncio.run(main(n)) == {'path': f'/loop/{n}'}
+            assert len(client.sessions) == 1
+        gc.collect()
+    assert not unclosed
+    assert not [w for w in caught if 'nclosed' in str(w.message)]
@@ -0,0 +1,50 @@
+import pytest
+from PIL import Image
+
+from lmm_cache import lmm_cached
+
+
+class lmm_gpt4v():
+    # stands in for the remote wrapper: the cache looks at the backend name only
+    model_path = 'stub'
+
+    def __init__(self):
+        self.calls = 0
+
+    def inference_batch(self, questions, images, num_return_sequences=1, temperature=None):
+        self.calls += 1
+        return [f'{question} {self.calls}' for question in questions for _ in range(num_return_sequences)]
+
+
+def test_gpt4v_is_cached_only_at_temperature_zero(tmp_path):
+    lmm = lmm_cached(lmm_gpt4v(), db_path=str(tmp_path / 'cache.sqlite'))
+    image = Image.new('RGB', (8, 8))
+
+    # API default temperature samples: every call reaches the API
+    assert lmm.inference('q', image) == 'q 1'
+    assert lmm.inference('q', image) == 'q 2'
+    assert lmm.hits == lmm.misses == 0
+
+    assert lmm.inference_batch(['q'], [image], temperature=0) == ['q 3']
+    assert lmm.inference_batch(['q'], [image], temperature=0) == ['q 3']
+    assert (lmm.hits, lmm.misses) == (1, 1)
+
+
+def test_gpt4v_temperature_zero_is_served_from_cache_on_the_next_run(tmp_path):
+    db_path = str(tmp_path / 'cache.sqlite')
+    image = Image.new('RGB', (8, 8))
+    first_run = lmm_cached(lmm_gpt4v(), db_path=db_path)
+    answer = first_run.inference('q', image, temperature=0)
+    assert first_run.lmm.calls == 1
+
+    second_run = lmm_cached(lmm_gpt4v(), db_path=db_path)
+    assert second_run.inference('q', image, temperature=0) == answer
+    assert second_run.lmm.calls == 0
+    assert (second_run.hits, second_run.misses) == (1, 0)
+
+
+def test_getattr_without_lmm_raises():
+    # as while unpickling, before __init__ state is restored
+    lmm = lmm_cached.__new__(lmm_cached)
+    with pytest.raises(AttributeError):
+        lmm.model_path
@@ -0,0 +1,109 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from PIL import Image
+
+from models import Memory
+from pipeline import StagedExecutor, prepare_case, run_iteration
+
+
+def sleeper(delay, fail_on=None):
+    def fn(batch):
+        outputs = []
+        for item in batch:
+            if item == fail_on:
+                raise RuntimeError(f'stage failed on {item}')
+            time.sleep(delay)
+            outputs.append(item)
+        return outputs
+    return fn
+
+
+def test_staged_executor_overlaps_stages_and_keeps_order():
+    stages = [('a', sleeper(0.1), 1), ('b', sleeper(0.1), 1), ('c', sleeper(0.1), 1)]
+    start_time = time.time()
+    results = StagedExecutor(stages).run(list(range(4)))
+    elapsed = time.time() - start_time
+    # 1.2s run stage after stage, about 0.6s pipelined
+    assert elapsed < 0.9
+    assert results == list(range(4))
+
+
+def test_staged_executor_raises_stage_errors_without_deadlock():
+    stages = [('a', sleeper(0.01), 1), ('b', sleeper(0.01, fail_on=2), 1), ('c', sleeper(0.01), 1)]
+    with ThreadPoolExecutor(1) as pool:
+        future = pool.submit(StagedExecutor(stages, max_queue_size=1).run, list(range(20)))
+        with pytest.raises(RuntimeError, match='failed on 2'):
+            future.result(timeout=10)
+
+
+class StubLMM():
+    def __init__(self):
+        self.images = []
+
+    def inference_batch(self, questions, images, num_return_sequences=1, temperature=None):
+        self.images += images
+        time.sleep(0.05)
+        return [f'prompt {n}' for _ in questions for n in range(num_return_sequences)]
+
+    def inference(self, question, image, temperature=None):
+        # selection and feedback are deterministic calls
+        assert temperature == 0
+        time.sleep(0.05)
+        return '1' if 'Which row' in question else 'no revision'
+
+
+class StubT2I():
+    def inference_batch(self, prompts, num_images_per_prompt=1):
+        time.sleep(0.2 * len(prompts) * num_images_per_prompt)
+        return [Image.new('RGB', (8, 8)) for _ in prompts for _ in range(num_images_per_prompt)]
+
+
+class StubI23D():
+    def inference_batch(self, png_paths, output_paths):
+        mesh_paths = []
+        for output_path in output_paths:
+            time.sleep(0.2)
+            for idx in range(6):
+                Image.new('RGB', (8, 8)).save(f'{output_path}/render_00{idx}.png')
+            open(f'{output_path}/mesh.obj', 'w').close()
+            mesh_paths.append(f'{output_path}/mesh.obj')
+        return mesh_paths
+
+
+def test_run_iteration_overlaps_t2i_and_i23d(tmp_path):
+    memory = Memory()
+    memory.idea_input_prompt = 'a red chair'
+    memory.idea_input_img = Image.new('RGB', (8, 8))
+    outpath = str(tmp_path)
+
+    start_time = time.time()
+    accepted = run_iteration(StubLMM(), StubT2I(), StubI23D(), memory, outpath, 0, num_img=1, num_draft=3)
+    elapsed = time.time() - start_time
+    # 0.05 + 3 x 0.2 (T2I) + 3 x 0.2 (I23D) + 0.1 = 1.35s stage after stage, about 0.95s overlapped
+    assert elapsed < 1.2
+    assert accepted
+    # row 1 is the second draft in generation order
+    assert memory.best_prompt == 'prompt 1'
+    assert memory.best_3d_path == f'{outpath}/draft/iter-1-1-0/mesh.obj'
+    assert os.path.exists(memory.best_3d_path)
+
+
+def test_text_only_case(tmp_path):
+    # a third of the dataset ideas have no <IMG> tag
+    idea_path = tmp_path / 'case'
+    idea_path.mkdir()
+    (idea_path / 'idea.txt').write_text('A wooden rocking horse painted red.')
+    outpath = str(tmp_path / 'out')
+    lmm = StubLMM()
+
+    memory = prepare_case(lmm, str(idea_path), outpath)
+    assert memory.idea_input_img is None
+    assert memory.idea_input_prompt == 'A wooden rocking horse painted red.'
+
+    assert run_iteration(lmm, StubT2I(), StubI23D(), memory, outpath, 0, num_img=1, num_draft=2)
+    # the prompts were asked for without an image
+    assert lmm.images == [None]
+    assert memory.best_prompt == 'prompt 1'